@@ -0,0 +1,240 @@
+import os
+import json
+import time
+import asyncio
+import logging
+from collections import OrderedDict
+from typing import List, Dict, Optional, Tuple
+
+# ==============================================================================
+# 会话历史存储
+# 设置了环境变量 REDIS_URL 时使用 Redis 存储：多个 worker 进程共享同一份会话，服务重启后也不会丢失；
+# 否则退回有容量上限的进程内存存储 (仅适用于单进程的开发环境)。
+# 存储中保存的是只追加的原始消息 (系统提示词 + 最近的 MAX_HISTORY_MESSAGES 条消息)，
+# 每轮对话只追加新产生的消息；交给agent之前再由 trim_history 压缩。
+# ==============================================================================
+
+log = logging.getLogger("srtp.conversation_store")
+
+# 会话在无访问后自动过期的时间 (秒)
+CONVERSATION_TTL = int(os.environ.get("SRTP_CONVERSATION_TTL", "3600"))
+# 内存存储最多保留的会话数，以及清除过期会话的间隔 (秒)
+CONVERSATION_CAPACITY = int(os.environ.get("SRTP_CONVERSATION_CAPACITY", "10000"))
+CONVERSATION_CLEANUP_INTERVAL = int(os.environ.get("SRTP_CONVERSATION_CLEANUP_INTERVAL", "60"))
+
+# 每个会话最多保存/使用的消息条数 (不含系统提示词)
+MAX_HISTORY_MESSAGES = int(os.environ.get("SRTP_MAX_HISTORY_MESSAGES", "50"))
+# 早于最近若干轮的消息会被压缩：工具调用细节保留3轮，图片数据保留2轮
+TOOL_CALL_KEEP_TURNS = 3
+IMAGE_KEEP_TURNS = 2
+
+def _turn_ages(messages: List[Dict]) -> List[int]:
+    """以用户消息划分轮次，返回每条消息所在轮次距最新一轮的距离 (最新一轮为0)。"""
+    ages = []
+    age = 0
+    for message in reversed(messages):
+        ages.append(age)
+        if message.get("role") == "user":
+            age += 1
+    return ages[::-1]
+
+def _is_failed_tool_response(message: Dict) -> bool:
+    try:
+        return json.loads(message.get("content") or "").get("status") == "error"
+    except (ValueError, AttributeError):
+        return False
+
+def _compact_message(message: Dict, age: int) -> Optional[Dict]:
+    """
+    按消息所在轮次的新旧程度分阶段压缩单条消息，返回压缩后的消息 (不修改原消息)，返回 None 表示丢弃。
+    """
+    role = message.get("role")
+
+    if age >= TOOL_CALL_KEEP_TURNS:
+        # 较早轮次的工具调用与推理过程对后续对话意义不大：工具结果整条丢弃，
+        # 助手消息只保留文本回答 (工具调用与其结果成对移除，保证历史仍是合法的消息序列)
+        if role == "tool":
+            return None
+        if role == "assistant":
+            message = {k: v for k, v in message.items() if k not in ("tool_calls", "reasoning_content", "thinking")}
+            if not message.get("content"):
+                return None
+
+    if role == "tool" and age >= 1 and _is_failed_tool_response(message):
+        # 之前轮次中失败的工具调用只保留一行错误提示
+        error_lines = str(json.loads(message["content"]).get("message") or "").strip().splitlines()
+        summary = error_lines[0][:200] if error_lines else ""
+        message = {**message, "content": json.dumps({"status": "error", "message": summary})}
+
+    if age >= IMAGE_KEEP_TURNS and isinstance(message.get("content"), list):
+        # 较早轮次中的图片 (如base64编码的GIF) 数据量大，用文字占位代替
+        message = {**message, "content": [
+            {"type": "text", "text": "[图片已省略]"} if part.get("type") == "image_url" else part
+            for part in message["content"]
+        ]}
+
+    return message
+
+def _split_system(messages: List[Dict]) -> Tuple[List[Dict], List[Dict]]:
+    """将消息列表拆分为开头的系统提示词 (0或1条) 与其余消息。"""
+    system = messages[:1] if messages and messages[0].get("role") == "system" else []
+    return system, messages[len(system):]
+
+def trim_history(messages: List[Dict], max_messages: int = MAX_HISTORY_MESSAGES) -> List[Dict]:
+    """
+    在交给agent之前裁剪对话历史：始终保留开头的系统提示词 (使其作为可缓存的固定前缀)，
+    较早轮次的消息分阶段压缩，再只保留最近的 max_messages 条消息。
+
+    :param messages: 完整的对话历史。
+    :param max_messages: 除系统提示词外最多保留的消息条数。
+    :return: 裁剪后的对话历史 (新列表)。
+    """
+    system, body = _split_system(messages)
+
+    compacted = []
+    for message, age in zip(body, _turn_ages(body)):
+        message = _compact_message(message, age)
+        if message is not None:
+            compacted.append(message)
+
+    tail = compacted[-max_messages:] if max_messages > 0 else []
+    # 窗口不能以工具结果开头，否则其对应的工具调用已被裁掉
+    start = 0
+    while start < len(tail) and tail[start].get("role") == "tool":
+        start += 1
+    return system + tail[start:]
+
+class InMemoryConversationStore:
+    """
+    将会话历史保存在当前进程内存中的 T-LRU 存储：容量有上限，且每个会话在 ttl 秒内无访问即过期。
+    超出容量时优先淘汰最久未访问的会话；后台任务定期清除已过期的会话。
+    """
+
+    def __init__(self, capacity: int = CONVERSATION_CAPACITY, ttl: int = CONVERSATION_TTL,
+                 cleanup_interval: int = CONVERSATION_CLEANUP_INTERVAL):
+        # conversation_id -> (过期时间, 消息列表)，按最近访问的先后排列
+        self._conversations: "OrderedDict[str, Tuple[float, List[Dict]]]" = OrderedDict()
+        self._capacity = capacity
+        self._ttl = ttl
+        self._cleanup_interval = cleanup_interval
+        self._cleanup_task = None
+
+    async def open(self):
+        self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def close(self):
+        if self._cleanup_task is not None:
+            self._cleanup_task.cancel()
+            try:
+                await self._cleanup_task
+            except asyncio.CancelledError:
+                pass
+        self._conversations.clear()
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self._cleanup_interval)
+            self.purge_expired()
+
+    def purge_expired(self):
+        """清除所有已过期的会话。"""
+        now = time.monotonic()
+        expired = [cid for cid, (expires_at, _) in self._conversations.items() if expires_at <= now]
+        for cid in expired:
+            del self._conversations[cid]
+
+    def _touch(self, conversation_id: str) -> Optional[List[Dict]]:
+        """返回未过期会话的消息并刷新其过期时间与访问顺序；会话不存在或已过期时返回 None。"""
+        entry = self._conversations.get(conversation_id)
+        if entry is None:
+            return None
+        expires_at, messages = entry
+        now = time.monotonic()
+        if expires_at <= now:
+            del self._conversations[conversation_id]
+            return None
+        self._conversations[conversation_id] = (now + self._ttl, messages)
+        self._conversations.move_to_end(conversation_id)
+        return messages
+
+    async def get(self, conversation_id: str) -> Optional[List[Dict]]:
+        return self._touch(conversation_id)
+
+    async def append(self, conversation_id: str, messages: List[Dict]):
+        """将新产生的消息追加到会话末尾 (会话不存在时新建)，只保留系统提示词与最近的 MAX_HISTORY_MESSAGES 条消息。"""
+        history = self._touch(conversation_id)
+        if history is None:
+            history = []
+        history.extend(messages)
+        system, body = _split_system(history)
+        if len(body) > MAX_HISTORY_MESSAGES:
+            del history[len(system):len(history) - MAX_HISTORY_MESSAGES]
+
+        self._conversations[conversation_id] = (time.monotonic() + self._ttl, history)
+        self._conversations.move_to_end(conversation_id)
+        while len(self._conversations) > self._capacity:
+            self._conversations.popitem(last=False)
+
+class RedisConversationStore:
+    """
+    将会话历史保存在 Redis 中：系统提示词保存在 conv:{conversation_id}:system 键中，
+    其余消息逐条以 orjson 序列化后保存在列表 conv:{conversation_id}:msgs 中。
+    每轮对话只 RPUSH 新产生的消息并用 LTRIM 保留最近的 MAX_HISTORY_MESSAGES 条，
+    写入量与对话长度无关；每次写入都会刷新过期时间，长时间不活跃的会话由 Redis 自动清除。
+    """
+
+    def __init__(self, url: str, ttl: int = CONVERSATION_TTL):
+        import orjson
+        import redis.asyncio as redis
+
+        self._orjson = orjson
+        self._redis = redis.Redis.from_url(url)
+        self._ttl = ttl
+
+    @staticmethod
+    def _keys(conversation_id: str) -> Tuple[str, str]:
+        return f"conv:{conversation_id}:system", f"conv:{conversation_id}:msgs"
+
+    def _dumps(self, message: Dict) -> bytes:
+        # OPT_SERIALIZE_NUMPY：工具结果中混入的numpy数值/数组也可直接序列化
+        return self._orjson.dumps(message, option=self._orjson.OPT_SERIALIZE_NUMPY)
+
+    async def open(self):
+        # 启动时先建立一次连接，使连接池在第一个请求到达前就已就绪
+        await self._redis.ping()
+
+    async def close(self):
+        await self._redis.aclose()
+
+    async def get(self, conversation_id: str) -> Optional[List[Dict]]:
+        system_key, msgs_key = self._keys(conversation_id)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            system, body = await pipe.get(system_key).lrange(msgs_key, 0, -1).execute()
+        if system is None and not body:
+            return None
+        history = [self._orjson.loads(system)] if system is not None else []
+        history.extend(self._orjson.loads(message) for message in body)
+        return history
+
+    async def append(self, conversation_id: str, messages: List[Dict]):
+        """将新产生的消息追加到会话末尾 (会话不存在时新建)，只保留系统提示词与最近的 MAX_HISTORY_MESSAGES 条消息。"""
+        system_key, msgs_key = self._keys(conversation_id)
+        system, body = _split_system(messages)
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if system:
+                pipe.set(system_key, self._dumps(system[0]))
+            if body:
+                pipe.rpush(msgs_key, *(self._dumps(message) for message in body))
+                pipe.ltrim(msgs_key, -MAX_HISTORY_MESSAGES, -1)
+            pipe.expire(system_key, self._ttl)
+            pipe.expire(msgs_key, self._ttl)
+            await pipe.execute()
+
+def create_conversation_store():
+    """根据环境变量 REDIS_URL 创建对应的会话存储。"""
+    redis_url = os.environ.get("REDIS_URL")
+    if redis_url:
+        log.info("使用Redis存储会话")
+        return RedisConversationStore(redis_url)
+    log.info("未设置 REDIS_URL，使用进程内存存储会话")
+    return InMemoryConversationStore()
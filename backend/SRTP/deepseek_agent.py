@@ -1,5 +1,14 @@
 import os
+import io
+import csv
 import json
+import functools
+import hashlib
+import tempfile
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+import matplotlib
 import pandas as pd
 from openai import OpenAI
 
@@ -7,24 +16,329 @@ from openai import OpenAI
 # 0. 配置和客户端设置
 # ==============================================================================
 
-# 定义输出目录 - 确保与main.py中的outputs目录一致
+# 使用非交互式的 Agg 后端渲染图片，跳过GUI后端的探测
+matplotlib.use("Agg")
+# 设置支持中文的字体，只需在导入时配置一次
+matplotlib.rcParams.update({
+    'font.sans-serif': ['SimHei'],  # 指定默认字体为黑体
+    'axes.unicode_minus': False,  # 解决保存图像是负号'-'显示为方块的问题
+})
+
+# 定义输出目录 - main.py 也使用该目录提供 /outputs 静态文件服务
 OUTPUT_DIR = "outputs"
 os.makedirs(OUTPUT_DIR, exist_ok=True)
 
-# 客户端设置：连接到 DeepSeek API
-try:
-    # 确保你已经设置了环境变量 DEEPSEEK_API_KEY
-    client = OpenAI(
-        api_key=os.environ.get("DEEPSEEK_API_KEY"),
-        base_url="https://api.deepseek.com/v1"
+# 底图瓦片的持久化缓存目录与并行下载连接数
+TILE_CACHE_DIR = os.environ.get("SRTP_TILE_CACHE_DIR", "tile_cache")
+TILE_CONNECTIONS = int(os.environ.get("SRTP_TILE_CONNECTIONS", "8"))
+
+# 进程的 umask (读取时会临时修改它，因此只在导入时读取一次)
+_UMASK = os.umask(0)
+os.umask(_UMASK)
+
+def create_temp_file(suffix: str, dir: str):
+    """
+    在 dir 中创建供原子替换 (os.replace) 使用的临时文件。
+    tempfile.mkstemp 创建的文件权限为 0600，替换后仍会保留，Nginx 等其他用户将无法读取；
+    这里改为与 open() 新建文件相同的 0666 & ~umask。
+
+    :return: (文件描述符, 临时文件路径)
+    """
+    fd, tmp_path = tempfile.mkstemp(suffix=suffix, dir=dir)
+    os.chmod(tmp_path, 0o666 & ~_UMASK)
+    return fd, tmp_path
+
+def create_http_client():
+    """
+    创建供 OpenAI 客户端复用的 HTTP 连接池：多轮对话中的每次模型调用都复用已建立的长连接，
+    无需重新进行 TCP 与 TLS 握手；安装了 h2 时启用 HTTP/2，并发请求可在同一连接上多路复用。
+    """
+    import importlib.util
+    import httpx
+
+    return httpx.Client(
+        limits=httpx.Limits(max_keepalive_connections=20, max_connections=50),
+        http2=importlib.util.find_spec("h2") is not None,
     )
-except Exception as e:
-    print("错误：请确保你已经设置了 DEEPSEEK_API_KEY 环境变量。")
-    exit()
+
+# 客户端设置：连接到 DeepSeek API
+# 客户端 (及其连接池) 由 init_client 创建：API 服务在启动阶段 (lifespan) 中调用，
+# 直接运行本脚本时在第一次请求模型时创建
+_client = None
+_client_lock = threading.Lock()
+
+def init_client() -> OpenAI:
+    """创建 (或返回已创建的) DeepSeek 客户端。"""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # 确保你已经设置了环境变量 DEEPSEEK_API_KEY
+            api_key = os.environ.get("DEEPSEEK_API_KEY")
+            if not api_key:
+                raise RuntimeError("错误：请确保你已经设置了 DEEPSEEK_API_KEY 环境变量。")
+            _client = OpenAI(
+                api_key=api_key,
+                base_url="https://api.deepseek.com/v1",
+                http_client=create_http_client(),
+            )
+        return _client
+
+def get_client() -> OpenAI:
+    """返回 DeepSeek 客户端，尚未创建时先创建。"""
+    return _client if _client is not None else init_client()
+
+def close_client():
+    """关闭 DeepSeek 客户端及其连接池。"""
+    global _client
+    with _client_lock:
+        if _client is not None:
+            _client.close()
+            _client = None
 
 # ==============================================================================
 # 1. 我们的工具函数：数据预处理 (无需修改，可直接使用)
 # ==============================================================================
+
+# 车辆轨迹XLSX文件的固定列结构
+VEHICLE_COLUMNS = ['timestamp', 'longitude', 'latitude', 'type', 'label']
+
+def _read_vehicle_xlsx(filepath: str):
+    """
+    针对车辆轨迹XLSX的固定列结构，使用 openpyxl 的只读流式模式逐行读取单元格的值，
+    直接写入类型固定的numpy数组 (容量不足时按倍数扩容)，不经过 pandas 通用解析路径中逐单元格的对象转换。
+    与 pd.read_excel 一致：空单元格读为 NaN，含空值的整数列按浮点数保存。
+
+    :param filepath: 原始数据的文件路径 (XLSX格式)。
+    :return: 包含 VEHICLE_COLUMNS 各列的 pyarrow.Table。
+    """
+    import numpy as np
+    import openpyxl
+    import pyarrow as pa
+
+    wb = openpyxl.load_workbook(filepath, read_only=True, data_only=True)
+    try:
+        ws = wb.active
+        # 文件中记录的表格尺寸 (<dimension>) 可能与实际数据不符：只用它估计初始容量，并忽略它读取全部行
+        capacity = max(ws.max_row or 0, 1024)
+        ws.reset_dimensions()
+        buffers = [np.empty(capacity, dtype=dtype) for dtype in (np.int64, np.float64, np.float64, np.int8)]
+        # 各数值列中空单元格所在的行号
+        blanks = [[] for _ in buffers]
+        labels = []
+        n = 0
+        for row in ws.iter_rows(max_col=len(VEHICLE_COLUMNS), values_only=True):
+            if all(value is None for value in row):
+                continue
+            if n == capacity:
+                capacity *= 2
+                buffers = [np.resize(buffer, capacity) for buffer in buffers]
+            for j, buffer in enumerate(buffers):
+                value = row[j] if j < len(row) else None
+                if value is None:
+                    blanks[j].append(n)
+                    value = 0
+                buffer[n] = value
+            labels.append(row[4] if len(row) > 4 else None)
+            n += 1
+    finally:
+        wb.close()
+
+    columns = []
+    for buffer, blank in zip(buffers, blanks):
+        column = buffer[:n]
+        if blank:
+            column = column.astype(np.float64)
+            column[blank] = np.nan
+        columns.append(column)
+
+    return pa.table(dict(zip(VEHICLE_COLUMNS, columns + [pa.array(labels)])))
+
+def _load_vehicle_dataset(filepath: str):
+    """
+    以列式数据集的形式加载车辆轨迹XLSX数据。
+    首次加载时解析XLSX（优先使用 calamine 引擎，否则使用 _read_vehicle_xlsx）并在同目录下缓存为Parquet文件，
+    之后直接读取缓存，XLSX更新后缓存会自动重建。
+
+    :param filepath: 原始数据的文件路径 (XLSX格式)。
+    :return: 指向Parquet缓存的 pyarrow.dataset.Dataset。
+    """
+    import pyarrow as pa
+    import pyarrow.dataset as ds
+    import pyarrow.parquet as pq
+
+    cache_path = os.path.splitext(filepath)[0] + ".parquet"
+    if not os.path.exists(cache_path) or os.path.getmtime(cache_path) < os.path.getmtime(filepath):
+        try:
+            df = pd.read_excel(filepath, header=None, names=VEHICLE_COLUMNS, engine='calamine')
+            table = pa.Table.from_pandas(df, preserve_index=False)
+        except (ImportError, ValueError):
+            # 未安装 python-calamine 或 pandas 版本过旧时回退到 openpyxl
+            table = _read_vehicle_xlsx(filepath)
+
+        # 先写入临时文件再原子替换，避免并发读取到写了一半的缓存
+        fd, tmp_path = create_temp_file(".parquet.tmp", os.path.dirname(cache_path) or ".")
+        os.close(fd)
+        try:
+            pq.write_table(table, tmp_path)
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    return ds.dataset(cache_path, format="parquet")
+
+# 点类型名称到 'type' 列取值的映射
+POINT_TYPE_CODES = {'start': 0, 'end': 1}
+
+def _convert_time_to_seconds(time_str: str) -> int:
+    """将 HH:MM:SS 或秒字符串转换为当日秒数"""
+    if time_str is None:
+        return None
+    try:
+        return int(time_str)
+    except ValueError:
+        parts = list(map(int, time_str.split(':')))
+        seconds = parts[0] * 3600
+        if len(parts) > 1:
+            seconds += parts[1] * 60
+        if len(parts) > 2:
+            seconds += parts[2]
+        return seconds
+
+# 行数超过该阈值时才使用 numba 内核，数据量较小时其编译开销得不偿失
+NUMBA_MASK_MIN_ROWS = 200_000
+# numba 的 workqueue 线程层不支持并发调用并行内核 (会直接终止进程)，
+# 而工具调用与对话都可能在多个线程中同时执行，因此内核调用需串行进行
+_point_mask_kernel_lock = threading.Lock()
+
+@functools.lru_cache(maxsize=None)
+def _get_point_mask_kernel():
+    """
+    返回融合所有筛选条件的 numba 并行内核（首次调用时编译，编译结果缓存到磁盘）。
+    未安装 numba 时返回 None。
+    """
+    try:
+        import numba
+    except ImportError:
+        return None
+    import numpy as np
+
+    @numba.njit(parallel=True, cache=True)
+    def _point_mask_kernel(ts, lon, lat, typ, check_type, type_code, check_start, start_seconds,
+                           check_end, end_seconds, check_bbox, min_lon, max_lon, min_lat, max_lat):
+        n = ts.size
+        out = np.empty(n, np.bool_)
+        for i in numba.prange(n):
+            # 未指定的条件直接跳过，而不是与恒成立的边界比较：与 NaN 的比较结果总为 False，
+            # 否则含空值的行即使未按该列筛选也会被丢弃
+            out[i] = ((not check_type or typ[i] == type_code)
+                      and (not check_start or ts[i] >= start_seconds)
+                      and (not check_end or ts[i] <= end_seconds)
+                      and (not check_bbox or (lon[i] >= min_lon and lon[i] <= max_lon
+                                              and lat[i] >= min_lat and lat[i] <= max_lat)))
+        return out
+
+    return _point_mask_kernel
+
+def _build_point_mask(ts, lon, lat, typ, type_code: int = None, start_seconds: int = None,
+                      end_seconds: int = None, bbox: list = None):
+    """
+    在底层numpy数组上一次性构建所有筛选条件的布尔掩码。
+    行数超过 NUMBA_MASK_MIN_ROWS 且安装了 numba 时，使用并行内核在一次遍历中完成所有比较，每行只写一次；
+    否则安装了 numexpr 时整个条件表达式只需一次（多线程的）遍历即可求值，
+    再否则使用原地 &= 依次合并，均不会为每个条件生成中间DataFrame。
+    返回 None 表示不过滤。
+    """
+    import numpy as np
+
+    variables = {"ts": ts, "lon": lon, "lat": lat, "typ": typ}
+    conditions = []
+    if type_code is not None:
+        variables["t"] = type_code
+        conditions.append("(typ == t)")
+    if start_seconds is not None:
+        variables["s"] = start_seconds
+        conditions.append("(ts >= s)")
+    if end_seconds is not None:
+        variables["e"] = end_seconds
+        conditions.append("(ts <= e)")
+    if bbox and len(bbox) == 4:
+        variables["mnl"], variables["mna"], variables["mxl"], variables["mxa"] = bbox
+        conditions.extend(["(lon >= mnl)", "(lon <= mxl)", "(lat >= mna)", "(lat <= mxa)"])
+
+    if not conditions:
+        return None
+
+    kernel = _get_point_mask_kernel() if len(ts) > NUMBA_MASK_MIN_ROWS else None
+    if kernel is not None:
+        # 每个条件是否生效由单独的标志传入；边界统一为float，避免为不同参数类型重复编译
+        check_bbox = bool(bbox) and len(bbox) == 4
+        min_lon, min_lat, max_lon, max_lat = bbox if check_bbox else (0.0, 0.0, 0.0, 0.0)
+        with _point_mask_kernel_lock:
+            return kernel(
+                ts, lon, lat, typ,
+                type_code is not None, type_code or 0,
+                start_seconds is not None, float(start_seconds or 0),
+                end_seconds is not None, float(end_seconds or 0),
+                check_bbox, float(min_lon), float(max_lon), float(min_lat), float(max_lat),
+            )
+
+    try:
+        import numexpr as ne
+        return ne.evaluate(" & ".join(conditions), local_dict=variables)
+    except ImportError:
+        mask = np.ones(len(ts), dtype=bool)
+        if type_code is not None:
+            mask &= typ == type_code
+        if start_seconds is not None:
+            mask &= ts >= start_seconds
+        if end_seconds is not None:
+            mask &= ts <= end_seconds
+        if bbox and len(bbox) == 4:
+            min_lon, min_lat, max_lon, max_lat = bbox
+            mask &= lon >= min_lon
+            mask &= lon <= max_lon
+            mask &= lat >= min_lat
+            mask &= lat <= max_lat
+        return mask
+
+def _preprocess_cache_path(filepath: str, point_type: str, start_time: str, end_time: str, bbox: list) -> str:
+    """根据源文件的路径、修改时间、大小以及全部筛选参数，计算预处理结果缓存文件的路径。"""
+    stat = os.stat(filepath)
+    key_source = repr((os.path.abspath(filepath), stat.st_mtime_ns, stat.st_size,
+                       point_type, start_time, end_time, tuple(bbox or ())))
+    key = hashlib.blake2b(key_source.encode(), digest_size=16).hexdigest()
+    return os.path.join(OUTPUT_DIR, f"cache_{key}.json")
+
+def _file_signature(path: str) -> list:
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+def _load_cached_preprocess(cache_path: str):
+    """
+    读取预处理结果缓存。只有当结果引用的输出文件仍然存在且未被改写时才视为命中
+    （不同bbox的调用会写出同名的输出文件），否则返回 None。
+    """
+    try:
+        with open(cache_path) as f:
+            cached = json.load(f)
+        for name, signature in cached["outputs"].items():
+            if _file_signature(os.path.join(OUTPUT_DIR, name)) != signature:
+                return None
+        return cached["result"]
+    except (OSError, ValueError, KeyError):
+        return None
+
+def _save_cached_preprocess(cache_path: str, result: dict):
+    outputs = {
+        name: _file_signature(os.path.join(OUTPUT_DIR, name))
+        for name in (result["output_filepath"], result["bounds_filepath"])
+    }
+    fd, tmp_path = create_temp_file(".json.tmp", OUTPUT_DIR)
+    with os.fdopen(fd, 'w') as f:
+        json.dump({"result": result, "outputs": outputs}, f)
+    os.replace(tmp_path, cache_path)
+
 def preprocess_vehicle_data(filepath: str, point_type: str = None, start_time: str = None, end_time: str = None, bbox: list = None):
     """
     预处理XLSX格式的车辆轨迹点数据。
@@ -37,21 +351,6 @@ def preprocess_vehicle_data(filepath: str, point_type: str = None, start_time: s
     :param bbox: 地理边界框，格式为 [min_lon, min_lat, max_lon, max_lat]。
     :return: 一个JSON字符串，包含处理结果的摘要。
     """
-    def _convert_time_to_seconds(time_str: str) -> int:
-        """将 HH:MM:SS 或秒字符串转换为当日秒数"""
-        if time_str is None:
-            return None
-        try:
-            return int(time_str)
-        except ValueError:
-            parts = list(map(int, time_str.split(':')))
-            seconds = parts[0] * 3600
-            if len(parts) > 1:
-                seconds += parts[1] * 60
-            if len(parts) > 2:
-                seconds += parts[2]
-            return seconds
-
     print(f"--- Python函数 `preprocess_vehicle_data` 被执行 ---")
     print(f"参数: filepath='{filepath}', point_type='{point_type}', start_time='{start_time}', end_time='{end_time}', bbox={bbox}")
     
@@ -60,32 +359,39 @@ def preprocess_vehicle_data(filepath: str, point_type: str = None, start_time: s
         print(f"错误：文件 '{filepath}' 不存在。请检查文件名和路径。")
         return json.dumps({"status": "error", "message": f"File not found: {filepath}"})
 
+    # 相同的源文件与筛选参数已处理过时，直接返回之前的结果
+    cache_path = _preprocess_cache_path(filepath, point_type, start_time, end_time, bbox)
+    cached_result = _load_cached_preprocess(cache_path)
+    if cached_result is not None:
+        print(f"   命中预处理缓存: {os.path.basename(cache_path)}")
+        return json.dumps(cached_result)
+
     try:
-        column_names = ['timestamp', 'longitude', 'latitude', 'type', 'label']
-        df = pd.read_excel(filepath, header=None, names=column_names, engine='openpyxl')
-        original_rows = len(df)
-        
-        if point_type == 'start':
-            df = df[df['type'] == 0]
-        elif point_type == 'end':
-            df = df[df['type'] == 1]
-            
+        import pyarrow as pa
+        import pyarrow.compute as pc
+        import pyarrow.csv as pa_csv
+
+        table = _load_vehicle_dataset(filepath).to_table()
+        original_rows = table.num_rows
+
         start_seconds = _convert_time_to_seconds(start_time)
         end_seconds = _convert_time_to_seconds(end_time)
 
-        if start_seconds is not None:
-            df = df[df['timestamp'] >= start_seconds]
-        if end_seconds is not None:
-            df = df[df['timestamp'] <= end_seconds]
-            
-        if bbox and len(bbox) == 4:
-            min_lon, min_lat, max_lon, max_lat = bbox
-            df = df[
-                (df['longitude'] >= min_lon) & (df['longitude'] <= max_lon) &
-                (df['latitude'] >= min_lat) & (df['latitude'] <= max_lat)
-            ]
-            
-        filtered_rows = len(df)
+        # 所有筛选条件合并为一个掩码，只对原始列数组做一次遍历，最后只过滤一次
+        mask = _build_point_mask(
+            table.column('timestamp').to_numpy(),
+            table.column('longitude').to_numpy(),
+            table.column('latitude').to_numpy(),
+            table.column('type').to_numpy(),
+            type_code=POINT_TYPE_CODES.get(point_type),
+            start_seconds=start_seconds,
+            end_seconds=end_seconds,
+            bbox=bbox,
+        )
+        if mask is not None:
+            table = table.filter(pa.array(mask))
+
+        filtered_rows = table.num_rows
         # -- 生成唯一的输出文件名 --
         base_name = os.path.splitext(os.path.basename(filepath))[0]
         filters_str = ""
@@ -101,14 +407,25 @@ def preprocess_vehicle_data(filepath: str, point_type: str = None, start_time: s
             filters_str = "_all"
 
         output_filename = os.path.join(OUTPUT_DIR, f"filtered_{base_name}{filters_str}.csv")
-        df.to_csv(output_filename, index=False)
+        # 直接在C层格式化并写出CSV。pyarrow 总是为表头加引号，因此表头用 csv 模块写入 (仅在必要时转义)；
+        # 数据行中的字符串值 (如 label 列) 仍会被 pyarrow 加上引号，与 DataFrame.to_csv 的输出并不逐字节相同
+        header = io.StringIO()
+        csv.writer(header, lineterminator="\n").writerow(table.column_names)
+        with open(output_filename, 'wb') as f:
+            f.write(header.getvalue().encode())
+            pa_csv.write_csv(
+                table, f,
+                write_options=pa_csv.WriteOptions(include_header=False, quoting_style="needed")
+            )
         
         # 生成范围配置文件
+        lon_range = pc.min_max(table.column('longitude')).as_py()
+        lat_range = pc.min_max(table.column('latitude')).as_py()
         bounds = {
-            "min_lon": df['longitude'].min(),
-            "min_lat": df['latitude'].min(),
-            "max_lon": df['longitude'].max(),
-            "max_lat": df['latitude'].max()
+            "min_lon": lon_range['min'],
+            "min_lat": lat_range['min'],
+            "max_lon": lon_range['max'],
+            "max_lat": lat_range['max']
         }
         bounds_filename = os.path.join(OUTPUT_DIR, f"bounds_{base_name}{filters_str}.json")
         with open(bounds_filename, 'w') as f:
@@ -122,6 +439,7 @@ def preprocess_vehicle_data(filepath: str, point_type: str = None, start_time: s
             "bounds_filepath": os.path.basename(bounds_filename),  # 范围配置文件
             "filters_applied": {"point_type": point_type, "time_range": [start_time, end_time], "bbox": bbox}
         }
+        _save_cached_preprocess(cache_path, result)
         
     except Exception as e:
         result = {"status": "error", "message": str(e)}
@@ -144,8 +462,7 @@ def get_overall_bounds(filepath: str, output_bounds_path: str = "overall_bounds.
         output_bounds_path = os.path.join(OUTPUT_DIR, output_bounds_path)
 
     try:
-        column_names = ['timestamp', 'longitude', 'latitude', 'type', 'label']
-        df = pd.read_excel(filepath, header=None, names=column_names, engine='openpyxl')
+        df = _load_vehicle_dataset(filepath).to_table(columns=['longitude', 'latitude']).to_pandas()
 
         bounds = {
             "min_lon": df['longitude'].min(),
@@ -166,6 +483,115 @@ def get_overall_bounds(filepath: str, output_bounds_path: str = "overall_bounds.
         
     return json.dumps(result)
 
+# 常见的经纬度列名
+LONGITUDE_ALIASES = frozenset({'longitude', 'lon', 'lng', 'long', 'x', 'X', 'Longitude', 'LON', 'LNG', 'LONG'})
+LATITUDE_ALIASES = frozenset({'latitude', 'lat', 'y', 'Y', 'Latitude', 'LAT'})
+
+def _find_coordinate_columns(df):
+    """
+    自动识别经纬度列名
+    返回 (longitude_col, latitude_col) 或 (None, None) 如果未找到
+    """
+    longitude_col = None
+    latitude_col = None
+
+    # 单次遍历列名，各自取第一个匹配的列
+    for col in df.columns:
+        if longitude_col is None and col in LONGITUDE_ALIASES:
+            longitude_col = col
+        elif latitude_col is None and col in LATITUDE_ALIASES:
+            latitude_col = col
+
+    return longitude_col, latitude_col
+
+def _assign_clusters(X, centers, labels, chunk_size: int = 256):
+    """
+    将每个点分配到最近的聚类中心，结果写入 labels。
+    利用 ||x - c||² = ||x||² + ||c||² - 2·x·cᵀ 展开：||x||² 对每个点是常数，不影响argmin，可直接省略；
+    每块距离矩阵先以 ||c||² 初始化，再由一次 GEMM 原地累加 -2·C·Xᵀ，并按 chunk_size 行分块，
+    使距离矩阵始终驻留在缓存中。
+    """
+    import numpy as np
+    from scipy.linalg.blas import get_blas_funcs
+
+    gemm = get_blas_funcs('gemm', (X, centers))
+    c_sq = np.einsum('ij,ij->i', centers, centers)
+    # Fortran序的 (k, chunk_size) 缓冲区，每一列都是 ||c||²
+    init_block = np.asfortranarray(np.repeat(c_sq[:, None], chunk_size, axis=1))
+    block = np.empty_like(init_block, order='F')
+
+    for start in range(0, X.shape[0], chunk_size):
+        X_block = X[start:start + chunk_size]
+        rows = X_block.shape[0]
+        dists = block[:, :rows]
+        dists[...] = init_block[:, :rows]
+        # centers.T 与 X_block.T 均为Fortran序视图，BLAS调用无需额外拷贝
+        dists = gemm(-2.0, centers.T, X_block.T, beta=1.0, c=dists, trans_a=True, overwrite_c=True)
+        labels[start:start + rows] = dists.argmin(axis=0)
+
+    return labels
+
+def _fit_kmeans_gemm(X, n_clusters: int, max_iter: int = 300, tol: float = 1e-4, random_state: int = 0):
+    """
+    基于BLAS GEMM的Lloyd K-Means实现。
+    使用 k-means++ 初始化，分配步骤见 _assign_clusters，中心更新使用 bincount 加权求和。
+
+    :param X: 形状为 (n, d) 的C序坐标数组，float32 时使用 sgemm，float64 时使用 dgemm。
+    :param n_clusters: 要创建的聚类数量 (K值)。
+    :return: 长度为 n 的簇标签数组。
+    """
+    import numpy as np
+    from sklearn.cluster import kmeans_plusplus
+
+    n_samples, n_features = X.shape
+    centers, _ = kmeans_plusplus(X, n_clusters, random_state=random_state)
+    centers = np.ascontiguousarray(centers, dtype=X.dtype)
+    labels = np.empty(n_samples, dtype=np.intp)
+    # 与sklearn一致：收敛阈值相对于数据各维方差的均值
+    tol = tol * X.var(axis=0).mean()
+
+    for _ in range(max_iter):
+        _assign_clusters(X, centers, labels)
+        counts = np.bincount(labels, minlength=n_clusters)
+        new_centers = centers.copy()
+        non_empty = counts > 0
+        for j in range(n_features):
+            # bincount 以float64累加，中心更新不受float32舍入误差累积影响
+            sums = np.bincount(labels, weights=X[:, j], minlength=n_clusters)
+            # 空簇保留原中心
+            new_centers[non_empty, j] = sums[non_empty] / counts[non_empty]
+        shift = ((new_centers - centers) ** 2).sum()
+        centers = new_centers
+        if shift <= tol:
+            break
+
+    return _assign_clusters(X, centers, labels)
+
+def _fit_kmeans(coords, n_clusters: int):
+    """
+    对二维坐标执行K-Means聚类，返回每个点的簇标签。
+    优先使用 faiss（SIMD/BLAS加速、多线程），未安装时回退到基于GEMM的 _fit_kmeans_gemm。
+
+    :param coords: 形状为 (n, 2) 的经纬度数组。
+    :param n_clusters: 要创建的聚类数量 (K值)。
+    :return: 长度为 n 的簇标签数组。
+    """
+    import numpy as np
+
+    # 距离计算统一使用float32：数据带宽减半，sgemm吞吐约为dgemm的两倍。
+    # 先在float64下减去均值再转换，避免经纬度的大数值在 ||c||² - 2·x·c 展开中发生灾难性抵消
+    X = np.ascontiguousarray(coords - coords.mean(axis=0), dtype=np.float32)
+
+    try:
+        import faiss
+    except ImportError:
+        return _fit_kmeans_gemm(X, n_clusters)
+
+    kmeans = faiss.Kmeans(d=X.shape[1], k=n_clusters, niter=20, nredo=1, seed=0, verbose=False)
+    kmeans.train(X)
+    _, labels = kmeans.index.search(X, 1)
+    return labels.ravel()
+
 def kmeans_cluster(input_filepath: str, n_clusters: int = 8, output_shapefile: str = "cluster_results.shp"):
     """
     对给定的CSV数据进行K-Means聚类，并输出为Shapefile。
@@ -182,36 +608,10 @@ def kmeans_cluster(input_filepath: str, n_clusters: int = 8, output_shapefile: s
     if not os.path.dirname(output_shapefile):
         output_shapefile = os.path.join(OUTPUT_DIR, output_shapefile)
 
-    def _find_coordinate_columns(df):
-        """
-        自动识别经纬度列名
-        返回 (longitude_col, latitude_col) 或 (None, None) 如果未找到
-        """
-        # 常见的经度列名
-        longitude_aliases = ['longitude', 'lon', 'lng', 'long', 'x', 'X', 'Longitude', 'LON', 'LNG', 'LONG']
-        # 常见的纬度列名  
-        latitude_aliases = ['latitude', 'lat', 'y', 'Y', 'Latitude', 'LAT']
-        
-        longitude_col = None
-        latitude_col = None
-        
-        # 查找经度列
-        for col in df.columns:
-            if col in longitude_aliases:
-                longitude_col = col
-                break
-        
-        # 查找纬度列
-        for col in df.columns:
-            if col in latitude_aliases:
-                latitude_col = col
-                break
-                
-        return longitude_col, latitude_col
-
     try:
-        from sklearn.cluster import KMeans
         import geopandas as gpd
+        import pyogrio
+        import shapely
 
         # 构造输入文件的完整路径
         full_input_path = os.path.join(OUTPUT_DIR, os.path.basename(input_filepath))
@@ -232,19 +632,14 @@ def kmeans_cluster(input_filepath: str, n_clusters: int = 8, output_shapefile: s
         print(f"   识别到经度列: '{longitude_col}', 纬度列: '{latitude_col}'")
 
         # 执行K-Means聚类
-        kmeans = KMeans(n_clusters=n_clusters, random_state=0, n_init=10)
-        df['cluster'] = kmeans.fit_predict(df[[longitude_col, latitude_col]])
+        df['cluster'] = _fit_kmeans(df[[longitude_col, latitude_col]].to_numpy(dtype=float), n_clusters)
 
-        # 创建GeoDataFrame
-        gdf = gpd.GeoDataFrame(
-            df, geometry=gpd.points_from_xy(df[longitude_col], df[latitude_col])
-        )
-        
-        # 设置坐标参考系统 (WGS84)
-        gdf.set_crs(epsg=4326, inplace=True)
+        # 创建GeoDataFrame：使用 shapely 2 的向量化构造点几何，坐标参考系统为 WGS84
+        geometry = shapely.points(df[longitude_col].to_numpy(), df[latitude_col].to_numpy())
+        gdf = gpd.GeoDataFrame(df, geometry=geometry, crs="EPSG:4326")
 
-        # 保存为Shapefile
-        gdf.to_file(output_shapefile, driver='ESRI Shapefile')
+        # 通过 pyogrio 批量写出Shapefile（比 Fiona 的逐条写入快得多）
+        pyogrio.write_dataframe(gdf, output_shapefile, driver='ESRI Shapefile')
 
         # 收集所有生成的 Shapefile 相关文件（返回相对路径）
         base_name = os.path.splitext(output_shapefile)[0]
@@ -268,20 +663,110 @@ def kmeans_cluster(input_filepath: str, n_clusters: int = 8, output_shapefile: s
         }
 
     except ImportError as e:
-        result = {"status": "error", "message": f"Missing required library: {e}. Please install scikit-learn and geopandas."}
+        result = {"status": "error", "message": f"Missing required library: {e}. Please install scikit-learn (or faiss-cpu), geopandas, and pyogrio."}
     except Exception as e:
         result = {"status": "error", "message": str(e)}
 
     return json.dumps(result)
+def _plot_density(ax, x, y, cmap: str = "Reds", alpha: float = 0.5, levels: int = 10,
+                  thresh: float = 0.05, gridsize: int = 512):
+    """
+    在ax上绘制点分布的填充核密度等值面。
+    使用 KDEpy 的 FFTKDE（分箱+FFT卷积，复杂度 O(n + g·log g)）代替 seaborn.kdeplot 的逐点求和，
+    等值面的划分方式与 seaborn 一致：按概率质量分位数取 levels 个等级，低于 thresh 的区域留空。
+    未安装 KDEpy 时回退到 seaborn.kdeplot。
+    """
+    import numpy as np
+
+    try:
+        from KDEpy import FFTKDE
+    except ImportError:
+        import seaborn as sns
+        sns.kdeplot(x=x, y=y, fill=True, cmap=cmap, alpha=alpha, levels=levels, thresh=thresh, ax=ax)
+        return
+
+    data = np.column_stack([np.asarray(x, dtype=float), np.asarray(y, dtype=float)])
+    # FFTKDE 只支持各向同性带宽：先按各维标准差缩放，再使用 Scott 规则 n^(-1/(d+4))
+    center = data.mean(axis=0)
+    scale = data.std(axis=0)
+    scale[scale == 0] = 1.0
+    standardized = (data - center) / scale
+    bw = len(data) ** (-1 / 6)
+
+    grid, density = FFTKDE(kernel='gaussian', bw=bw).fit(standardized).evaluate(gridsize)
+    grid_x = np.unique(grid[:, 0]) * scale[0] + center[0]
+    grid_y = np.unique(grid[:, 1]) * scale[1] + center[1]
+    density = density.reshape(gridsize, gridsize).T
+
+    # 将概率质量分位数转换为密度等级
+    sorted_density = np.sort(density, axis=None)[::-1]
+    cumulative = np.cumsum(sorted_density) / sorted_density.sum()
+    isoprop = np.linspace(thresh, 1, levels)
+    contour_levels = np.take(sorted_density, np.searchsorted(cumulative, 1 - isoprop), mode="clip")
+    contour_levels = np.unique(np.append(contour_levels, density.max()))
+
+    ax.contourf(grid_x, grid_y, density, levels=contour_levels, cmap=cmap, alpha=alpha, rasterized=True)
+
+@functools.lru_cache(maxsize=None)
+def _get_mercator_transformer(source_crs: str = "EPSG:4326"):
+    """返回（并缓存）从 source_crs 到 Web Mercator (EPSG:3857) 的坐标转换器。"""
+    from pyproj import Transformer
+
+    return Transformer.from_crs(source_crs, "EPSG:3857", always_xy=True)
+
+def _to_web_mercator(gdf):
+    """
+    将点要素的GeoDataFrame转换到 Web Mercator (EPSG:3857)。
+    对点数据直接取出坐标数组，通过一次向量化的 pyproj 调用完成投影，再用 shapely.points 重建几何；
+    其他几何类型仍使用 GeoDataFrame.to_crs。
+    """
+    import geopandas as gpd
+    import shapely
+
+    if gdf.crs is None or not (gdf.geom_type == "Point").all():
+        return gdf.to_crs(epsg=3857)
+
+    coords = shapely.get_coordinates(gdf.geometry.values)
+    x, y = _get_mercator_transformer(gdf.crs.to_string()).transform(coords[:, 0], coords[:, 1])
+    return gdf.set_geometry(gpd.GeoSeries(shapely.points(x, y), index=gdf.index, crs="EPSG:3857"))
+
+# 高德地图瓦片地址
+GAODE_TILE_URL = "https://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=8&x={x}&y={y}&z={z}"
+
+@functools.lru_cache(maxsize=None)
+def _configure_tile_cache():
+    """将 contextily 的瓦片缓存指向持久化目录（每个进程只需设置一次）。"""
+    import contextily as ctx
+
+    os.makedirs(TILE_CACHE_DIR, exist_ok=True)
+    ctx.set_cache_dir(TILE_CACHE_DIR)
+
+def _add_basemap(ax):
+    """
+    为 Web Mercator (EPSG:3857) 坐标系下的 ax 添加高德底图，保持当前的显示范围不变。
+    瓦片以 TILE_CONNECTIONS 个连接并行下载，并缓存在 TILE_CACHE_DIR 中，
+    后续调用（包括服务重启后）命中缓存时无需再次发起网络请求。
+    """
+    import contextily as ctx
+
+    _configure_tile_cache()
+    xmin, xmax, ymin, ymax = ax.axis()
+    image, extent = ctx.bounds2img(
+        xmin, ymin, xmax, ymax, source=GAODE_TILE_URL, ll=False, n_connections=TILE_CONNECTIONS
+    )
+    ax.imshow(image, extent=extent, interpolation='bilinear')
+    ax.axis((xmin, xmax, ymin, ymax))
+
 def create_heatmap(input_filepath: str, output_image_path: str = "heatmap.png",
                   map_title: str = "Taxies Hotspot Analysis Heatmap",
-                  bounds_filepath: str = None):
+                  bounds_filepath: str = None, dpi: int = 150):
     """
     根据输入的CSV点数据生成一张带有底图的热力图。
 
     :param input_filepath: 输入的CSV文件路径 (需要包含经纬度列，支持多种命名方式)。
     :param output_image_path: 输出的热力图图片文件路径 (PNG格式)。
     :param map_title: 地图的标题。
+    :param dpi: 输出图片的分辨率 (每英寸点数)。
     :return: 包含操作状态和图片路径的JSON字符串。
     """
     print(f"--- Python函数 `create_heatmap` 被执行 ---")
@@ -291,44 +776,13 @@ def create_heatmap(input_filepath: str, output_image_path: str = "heatmap.png",
     if not os.path.dirname(output_image_path):
         output_image_path = os.path.join(OUTPUT_DIR, output_image_path)
 
-    def _find_coordinate_columns(df):
-        """
-        自动识别经纬度列名
-        返回 (longitude_col, latitude_col) 或 (None, None) 如果未找到
-        """
-        # 常见的经度列名
-        longitude_aliases = ['longitude', 'lon', 'lng', 'long', 'x', 'X', 'Longitude', 'LON', 'LNG', 'LONG']
-        # 常见的纬度列名  
-        latitude_aliases = ['latitude', 'lat', 'y', 'Y', 'Latitude', 'LAT']
-        
-        longitude_col = None
-        latitude_col = None
-        
-        # 查找经度列
-        for col in df.columns:
-            if col in longitude_aliases:
-                longitude_col = col
-                break
-        
-        # 查找纬度列
-        for col in df.columns:
-            if col in latitude_aliases:
-                latitude_col = col
-                break
-                
-        return longitude_col, latitude_col
-
     try:
-        import geopandas as gpd
-        import matplotlib.pyplot as plt
-        import contextily as ctx
-        import seaborn as sns
-        from pyproj import Transformer
+        from matplotlib.figure import Figure
 
         # 构造输入文件的完整路径
         full_input_path = os.path.join(OUTPUT_DIR, os.path.basename(input_filepath))
 
-        # 从CSV创建GeoDataFrame
+        # 读取CSV点数据
         df = pd.read_csv(full_input_path)
         
         # 自动识别经纬度列
@@ -343,38 +797,22 @@ def create_heatmap(input_filepath: str, output_image_path: str = "heatmap.png",
         
         print(f"   识别到经度列: '{longitude_col}', 纬度列: '{latitude_col}'")
         
-        gdf = gpd.GeoDataFrame(
-            df, geometry=gpd.points_from_xy(df[longitude_col], df[latitude_col])
-        ).set_crs(epsg=4326)
-
-        # 确保坐标系为Web Mercator (EPSG:3857) 以便匹配底图
-        gdf = gdf.to_crs(epsg=3857)
+        # 将经纬度一次性批量投影到Web Mercator (EPSG:3857) 以便匹配底图，
+        # 热力图只需要坐标数组，无需构造几何对象
+        transformer = _get_mercator_transformer()
+        x, y = transformer.transform(df[longitude_col].to_numpy(), df[latitude_col].to_numpy())
 
         # 创建图表
-        # 设置支持中文的字体
-        plt.rcParams['font.sans-serif'] = ['SimHei']  # 指定默认字体为黑体
-        plt.rcParams['axes.unicode_minus'] = False  # 解决保存图像是负号'-'显示为方块的问题
-
-        fig, ax = plt.subplots(1, 1, figsize=(12, 12))
+        # 直接使用 Figure 对象而不经过 pyplot 的全局状态机，无需手动关闭图表
+        fig = Figure(figsize=(12, 12))
+        ax = fig.subplots(1, 1)
         # 强制地图x/y轴等比例，这对保证比例尺一致性至关重要
         ax.set_aspect('equal')
 
-        # 使用seaborn的kdeplot创建核密度估计图
-        sns.kdeplot(
-            x=gdf.geometry.x,
-            y=gdf.geometry.y,
-            fill=True,
-            cmap="Reds",
-            alpha=0.5,
-            ax=ax
-        )
+        # 创建核密度估计图
+        _plot_density(ax, x, y, cmap="Reds", alpha=0.5)
         
         # 添加底图
-        # 定义并使用高德地图作为底图
-        gaode_map_provider = {
-            "url": "https://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=8&x={x}&y={y}&z={z}",
-            "attribution": "© 高德地图",
-        }
         # 如果有范围配置文件，使用固定范围
         if bounds_filepath:
             bounds_path = os.path.join(OUTPUT_DIR, bounds_filepath)
@@ -382,16 +820,15 @@ def create_heatmap(input_filepath: str, output_image_path: str = "heatmap.png",
                 bounds = json.load(f)
             
             # 转换坐标到Web Mercator
-            transformer = Transformer.from_crs("EPSG:4326", "EPSG:3857", always_xy=True)
             min_x, min_y = transformer.transform(bounds['min_lon'], bounds['min_lat'])
             max_x, max_y = transformer.transform(bounds['max_lon'], bounds['max_lat'])
             
             # 设置固定范围并添加底图
             ax.set_xlim(min_x, max_x)
             ax.set_ylim(min_y, max_y)
-            ctx.add_basemap(ax, source=gaode_map_provider['url'], crs=gdf.crs.to_string())
-        else:
-            ctx.add_basemap(ax, source=gaode_map_provider['url'], crs=gdf.crs.to_string())
+
+        # 使用高德地图作为底图
+        _add_basemap(ax)
 
         # --- 添加地图元素 ---
         # 1. 添加比例尺
@@ -410,8 +847,7 @@ def create_heatmap(input_filepath: str, output_image_path: str = "heatmap.png",
         ax.set_axis_off() # 关闭坐标轴
 
         # 保存图表
-        plt.savefig(output_image_path, dpi=300, bbox_inches='tight')
-        plt.close(fig) # 关闭图表以释放内存
+        fig.savefig(output_image_path, dpi=dpi, bbox_inches='tight')
 
         result = {
             "status": "success",
@@ -419,11 +855,35 @@ def create_heatmap(input_filepath: str, output_image_path: str = "heatmap.png",
         }
 
     except ImportError as e:
-        result = {"status": "error", "message": f"Missing required library: {e}. Please install geopandas, matplotlib, contextily, and seaborn."}
+        result = {"status": "error", "message": f"Missing required library: {e}. Please install pyproj, matplotlib, contextily, and KDEpy (or seaborn)."}
     except Exception as e:
         result = {"status": "error", "message": str(e)}
 
     return json.dumps(result)
+def _load_gif_frame(path: str):
+    """读取一张图片并立即量化为调色板 ('P') 模式，读取后随即关闭文件。"""
+    from PIL import Image
+
+    with Image.open(path) as image:
+        return image.convert("RGB").convert("P", palette=Image.Palette.ADAPTIVE)
+
+def _iter_gif_frames(image_paths: list):
+    """
+    按原顺序产出量化后的GIF帧。
+    PNG解码与调色板量化都在Pillow的C层执行并会释放GIL，因此使用线程池并行处理各帧；
+    提前量化也让GIF编码器省去了自己的调色板计算。
+    同时最多只有 max_workers 帧在处理或等待写出，内存占用不随帧数增长。
+    """
+    max_workers = max(1, min(len(image_paths), os.cpu_count() or 1))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending = deque()
+        for path in image_paths:
+            if len(pending) == max_workers:
+                yield pending.popleft().result()
+            pending.append(executor.submit(_load_gif_frame, path))
+        while pending:
+            yield pending.popleft().result()
+
 def create_gif_from_images(image_files: list, output_gif_path: str = "animated_result.gif", fps: int = 2):
     """
     将一系列输入的图片文件合成为一个GIF动图。
@@ -448,20 +908,23 @@ def create_gif_from_images(image_files: list, output_gif_path: str = "animated_r
 
         # 构造每个输入文件的完整路径
         full_image_paths = [os.path.join(OUTPUT_DIR, os.path.basename(f)) for f in image_files]
-        frames = [Image.open(f) for f in full_image_paths]
-        
-        if not frames:
-            return json.dumps({"status": "error", "message": "Could not open any images from the provided list."})
 
-        frames[0].save(
+        # 帧是惰性读取的，先检查所有文件都存在，避免写出不完整的GIF
+        for f in full_image_paths:
+            if not os.path.exists(f):
+                raise FileNotFoundError(2, "No such file or directory", f)
+
+        frames = _iter_gif_frames(full_image_paths)
+        first_frame = next(frames)
+        first_frame.save(
             output_gif_path,
             save_all=True,
-            append_images=frames[1:],
+            append_images=frames,
             duration=1000 / fps,
             loop=0
         )
         
-        result = {"status": "success", "output_gif_path": os.path.basename(output_gif_path), "image_count": len(frames)}  # 只返回文件名
+        result = {"status": "success", "output_gif_path": os.path.basename(output_gif_path), "image_count": len(full_image_paths)}  # 只返回文件名
 
     except ImportError:
         result = {"status": "error", "message": "Missing required library: Pillow (PIL). Please install it."}
@@ -471,13 +934,74 @@ def create_gif_from_images(image_files: list, output_gif_path: str = "animated_r
         result = {"status": "error", "message": str(e)}
 
     return json.dumps(result)
-def visualize_clusters(input_shapefile: str, output_image_path: str = "cluster_visualization.png", map_title: str = "Cluster Analysis Visualization"):
+# 点数超过该阈值时，聚类结果改用 datashader 栅格化绘制
+DATASHADER_MIN_POINTS = 50_000
+
+def _plot_cluster_points(ax, gdf, dpi: int, cmap: str = 'tab20', markersize: float = 10):
+    """
+    按 'cluster' 列分类着色绘制 Web Mercator 坐标下的点，并添加图例。
+    点数较多且安装了 datashader 时，先用 count_cat 将点聚合为固定分辨率的RGBA栅格再以 imshow 绘制，
+    绘制开销只与栅格大小有关而与点数无关；否则退回 geopandas 的逐点绘制。
+    """
+    if len(gdf) < DATASHADER_MIN_POINTS:
+        gdf.plot(column='cluster', ax=ax, legend=True, markersize=markersize, cmap=cmap, categorical=True, rasterized=True)
+        return
+
+    try:
+        import datashader as ds
+        import datashader.transfer_functions as tf
+    except ImportError:
+        gdf.plot(column='cluster', ax=ax, legend=True, markersize=markersize, cmap=cmap, categorical=True, rasterized=True)
+        return
+
+    import numpy as np
+    from matplotlib.colors import to_hex
+    from matplotlib.lines import Line2D
+
+    x = gdf.geometry.x.to_numpy()
+    y = gdf.geometry.y.to_numpy()
+    clusters = pd.Categorical(gdf['cluster'].to_numpy())
+
+    # 与 geopandas 分类绘图一致：按类别顺序依次取离散色表中的颜色
+    colormap = matplotlib.colormaps[cmap]
+    colors = [to_hex(colormap(i % colormap.N)) for i in range(len(clusters.categories))]
+    color_key = dict(zip(clusters.categories, colors))
+
+    # 四周各留 5% 的边距（与 matplotlib 默认的 axes.margins 一致），栅格宽度取坐标轴在输出图片中的像素宽度
+    xmin, xmax = float(np.min(x)), float(np.max(x))
+    ymin, ymax = float(np.min(y)), float(np.max(y))
+    pad = 0.05 * max(xmax - xmin, ymax - ymin) or 1.0
+    xmin, xmax, ymin, ymax = xmin - pad, xmax + pad, ymin - pad, ymax + pad
+    width = max(1, int(ax.figure.get_figwidth() * ax.get_position().width * dpi))
+    height = max(1, round(width * (ymax - ymin) / (xmax - xmin)))
+
+    canvas = ds.Canvas(plot_width=width, plot_height=height, x_range=(xmin, xmax), y_range=(ymin, ymax))
+    agg = canvas.points(pd.DataFrame({'x': x, 'y': y, 'cluster': clusters}), 'x', 'y', ds.count_cat('cluster'))
+    # 像素不透明，按点的直径（markersize 为面积，单位 pt²）扩展像素，使观感接近逐点绘制
+    image = tf.shade(agg, color_key=color_key, min_alpha=255)
+    image = tf.spread(image, px=max(1, round(np.sqrt(markersize) / 72 * dpi / 2)))
+
+    # to_pil() 已将图像翻转为自上而下的行序；zorder 高于随后添加的底图
+    ax.imshow(np.asarray(image.to_pil()), extent=(xmin, xmax, ymin, ymax), origin='upper',
+              interpolation='nearest', zorder=2)
+    ax.set_xlim(xmin, xmax)
+    ax.set_ylim(ymin, ymax)
+
+    handles = [
+        Line2D([0], [0], linestyle='none', marker='o', markersize=10, markerfacecolor=color, markeredgewidth=0, label=str(name))
+        for name, color in color_key.items()
+    ]
+    ax.legend(handles=handles)
+
+def visualize_clusters(input_shapefile: str, output_image_path: str = "cluster_visualization.png", map_title: str = "Cluster Analysis Visualization",
+                       dpi: int = 150):
     """
     根据输入的Shapefile点数据（包含'cluster'字段），生成一张带有底图、指北针和比例尺的可视化图。
 
     :param input_shapefile: 输入的Shapefile文件路径，必须包含 'cluster' 字段。
     :param output_image_path: 输出的图片文件路径 (PNG格式)。
     :param map_title: 地图的标题。
+    :param dpi: 输出图片的分辨率 (每英寸点数)。
     :return: 包含操作状态和图片路径的JSON字符串。
     """
     print(f"--- Python函数 `visualize_clusters` 被执行 ---")
@@ -489,35 +1013,36 @@ def visualize_clusters(input_shapefile: str, output_image_path: str = "cluster_v
 
     try:
         import geopandas as gpd
-        import matplotlib.pyplot as plt
-        import contextily as ctx
+        from matplotlib.figure import Figure
         from matplotlib_scalebar.scalebar import ScaleBar
 
         # 构造输入文件的完整路径
         full_input_path = os.path.join(OUTPUT_DIR, os.path.basename(input_shapefile))
 
-        # 读取Shapefile
-        gdf = gpd.read_file(full_input_path)
-        if 'cluster' not in gdf.columns:
-            return json.dumps({"status": "error", "message": "Input Shapefile must contain a 'cluster' column."})
+        # 读取Shapefile：绘图只需要 'cluster' 字段和几何，其余属性列不做解析
+        try:
+            import pyogrio
+        except ImportError:
+            gdf = gpd.read_file(full_input_path)
+            if 'cluster' not in gdf.columns:
+                return json.dumps({"status": "error", "message": "Input Shapefile must contain a 'cluster' column."})
+        else:
+            if 'cluster' not in pyogrio.read_info(full_input_path)['fields']:
+                return json.dumps({"status": "error", "message": "Input Shapefile must contain a 'cluster' column."})
+            gdf = pyogrio.read_dataframe(full_input_path, columns=['cluster'])
 
         # 确保坐标系为Web Mercator (EPSG:3857)
-        gdf = gdf.to_crs(epsg=3857)
+        gdf = _to_web_mercator(gdf)
 
         # --- 绘图 ---
-        plt.rcParams['font.sans-serif'] = ['SimHei']
-        plt.rcParams['axes.unicode_minus'] = False
-        fig, ax = plt.subplots(1, 1, figsize=(12, 12))
+        fig = Figure(figsize=(12, 12))
+        ax = fig.subplots(1, 1)
 
         # 按 'cluster' 列对点进行分类着色
-        gdf.plot(column='cluster', ax=ax, legend=True, markersize=10, cmap='tab20', categorical=True)
-        
+        _plot_cluster_points(ax, gdf, dpi)
+
         # 添加高德底图
-        gaode_map_provider = {
-            "url": "https://webrd01.is.autonavi.com/appmaptile?lang=zh_cn&size=1&scale=1&style=8&x={x}&y={y}&z={z}",
-            "attribution": "© 高德地图",
-        }
-        ctx.add_basemap(ax, source=gaode_map_provider['url'], crs=gdf.crs.to_string())
+        _add_basemap(ax)
         
         # --- 添加地图元素 ---
         # 1. 添加比例尺
@@ -535,8 +1060,7 @@ def visualize_clusters(input_shapefile: str, output_image_path: str = "cluster_v
         ax.set_axis_off()
 
         # 保存图表
-        plt.savefig(output_image_path, dpi=300, bbox_inches='tight')
-        plt.close(fig)
+        fig.savefig(output_image_path, dpi=dpi, bbox_inches='tight')
 
         result = {"status": "success", "output_image_path": os.path.basename(output_image_path)}  # 只返回文件名
 
@@ -549,7 +1073,8 @@ def visualize_clusters(input_shapefile: str, output_image_path: str = "cluster_v
 # ==============================================================================
 # 2. 为LLM定义工具的描述 (无需修改)
 # ==============================================================================
-tools_description = [
+# 工具描述始终作为每次请求的固定前缀发送，定义为不可变的元组，保证前缀逐字节不变以命中服务端的提示缓存
+tools_description = (
     {
         "type": "function",
         "function": {
@@ -610,7 +1135,8 @@ tools_description = [
                     "input_filepath": { "type": "string", "description": "输入的点数据CSV文件路径。函数会自动识别常见的经纬度列名。通常是数据预处理步骤的输出。"},
                     "output_image_path": { "type": "string", "description": "输出的热力图图片文件路径。例如, 'heatmap.png'。"},
                     "map_title": { "type": "string", "description": "要显示在热力图顶部的标题。"},
-                    "bounds_filepath": { "type": "string", "description": "一个包含地图边界的JSON文件的路径。通常由preprocess_vehicle_data函数生成。如果提供，热力图将使用这个固定的地理范围。"}
+                    "bounds_filepath": { "type": "string", "description": "一个包含地图边界的JSON文件的路径。通常由preprocess_vehicle_data函数生成。如果提供，热力图将使用这个固定的地理范围。"},
+                    "dpi": { "type": "integer", "description": "输出图片的分辨率（每英寸点数），默认为150。仅在用户要求更高清晰度时才需提高。"}
                 },
                 "required": ["input_filepath"],
             },
@@ -646,17 +1172,159 @@ tools_description = [
                 "properties": {
                     "input_shapefile": { "type": "string", "description": "输入的点数据Shapefile文件路径, 必须包含'cluster'列。通常是kmeans_cluster函数的输出。"},
                     "output_image_path": { "type": "string", "description": "输出的可视化图片文件路径。例如, 'cluster_map.png'。"},
-                    "map_title": { "type": "string", "description": "要显示在图片顶部的标题。"}
+                    "map_title": { "type": "string", "description": "要显示在图片顶部的标题。"},
+                    "dpi": { "type": "integer", "description": "输出图片的分辨率（每英寸点数），默认为150。仅在用户要求更高清晰度时才需提高。"}
                 },
                 "required": ["input_shapefile"],
             },
         }
-    }
-]
+    },
+)
+
+# 工具名称到本地函数的映射
+available_functions = {
+    "preprocess_vehicle_data": preprocess_vehicle_data,
+    "get_overall_bounds": get_overall_bounds,
+    "kmeans_cluster": kmeans_cluster,
+    "create_heatmap": create_heatmap,
+    "create_gif_from_images": create_gif_from_images,
+    "visualize_clusters": visualize_clusters,
+}
 
 # ==============================================================================
 # 3. 主流程：与 DeepSeek V2 模型交互
 # ==============================================================================
+def _request_model_response(messages: list, on_tool_call=None) -> dict:
+    """
+    以流式方式请求模型的下一条回复，并将增量片段拼接为完整的 assistant 消息。
+    某个工具调用的参数一旦接收完整（可被解析为JSON对象，或流中出现了下一个工具调用），
+    就立即回调 on_tool_call，使本地函数的执行与模型剩余内容的生成相互重叠。
+
+    :param messages: 当前的对话历史。
+    :param on_tool_call: 接收单个工具调用字典的回调函数，按工具调用的顺序各调用一次。
+    :return: 可直接追加到对话历史中的 assistant 消息字典。
+    """
+    stream = get_client().chat.completions.create(
+        model="deepseek-chat",
+        messages=messages,
+        tools=tools_description,
+        tool_choice="auto",
+        stream=True,
+    )
+
+    content_parts = []
+    tool_calls = []
+    dispatched = 0  # 已回调的工具调用数量
+
+    def _dispatch_until(count: int):
+        nonlocal dispatched
+        while dispatched < count:
+            if on_tool_call:
+                on_tool_call(tool_calls[dispatched])
+            dispatched += 1
+
+    for chunk in stream:
+        if not chunk.choices:
+            continue
+        delta = chunk.choices[0].delta
+        if delta.content:
+            content_parts.append(delta.content)
+
+        for tool_call_delta in delta.tool_calls or []:
+            index = tool_call_delta.index
+            if index >= len(tool_calls):
+                # 出现新的工具调用，说明之前的工具调用都已接收完整
+                _dispatch_until(len(tool_calls))
+                tool_calls.append({"id": None, "type": "function", "function": {"name": "", "arguments": ""}})
+            tool_call = tool_calls[index]
+            if tool_call_delta.id:
+                tool_call["id"] = tool_call_delta.id
+            function = tool_call_delta.function
+            if function is None:
+                continue
+            if function.name:
+                tool_call["function"]["name"] += function.name
+            if function.arguments:
+                tool_call["function"]["arguments"] += function.arguments
+                # 完整的JSON对象不可能再被后续片段扩展，能解析即可提前执行
+                if index == dispatched and tool_call["function"]["arguments"].rstrip().endswith("}"):
+                    try:
+                        json.loads(tool_call["function"]["arguments"])
+                    except json.JSONDecodeError:
+                        pass
+                    else:
+                        _dispatch_until(index + 1)
+
+    _dispatch_until(len(tool_calls))
+
+    message = {"role": "assistant", "content": "".join(content_parts) or None}
+    if tool_calls:
+        message["tool_calls"] = tool_calls
+    return message
+
+def _execute_tool_call(tool_call: dict, generated_files: list):
+    """
+    执行模型请求的单个工具调用，并收集其生成的文件。
+
+    :return: 工具结果消息 (出错时其内容为错误信息)。
+    """
+    function_name = tool_call["function"]["name"]
+    try:
+        function_args = json.loads(tool_call["function"]["arguments"])
+        print(f"   - 函数名: {function_name}")
+        print(f"   - 模型解析出的参数: {function_args}")
+
+        function_to_call = available_functions.get(function_name)
+        
+        if function_to_call:
+            function_response_str = function_to_call(**function_args)
+            response_data = json.loads(function_response_str)
+
+            # 收集所有输出的文件路径
+            for key, value in response_data.items():
+                if 'path' in key and isinstance(value, str):
+                    generated_files.append(value)
+                elif key == 'generated_files' and isinstance(value, list):
+                    generated_files.extend(value)
+            
+            if response_data.get("status") == "error":
+                print(f"❌ 函数执行失败: {response_data.get('message')}")
+            
+            # 将成功的工具执行结果添加到历史记录
+            return {
+                "tool_call_id": tool_call["id"],
+                "role": "tool",
+                "name": function_name,
+                "content": function_response_str,
+            }
+        else:
+            raise ValueError(f"未知函数: {function_name}")
+
+    except (json.JSONDecodeError, TypeError, ValueError, KeyError) as e:
+        # 如果参数解析失败或函数执行出错，向模型报告错误
+        print(f"❌ 调用函数 '{function_name}' 时出错: {e}")
+        error_message = f"Error calling function {function_name}: {str(e)}. Please check your arguments."
+        return {
+            "tool_call_id": tool_call["id"],
+            "role": "tool",
+            "name": function_name,
+            "content": json.dumps({"status": "error", "message": error_message}),
+        }
+
+# 为模型设置角色和行为准则。
+# 所有对话都使用同一条系统提示词，与工具描述一起构成逐字节不变的请求前缀，
+# 服务端 (DeepSeek 的上下文硬盘缓存会自动缓存相同的前缀) 可以跨对话复用这部分的计算结果
+SYSTEM_PROMPT = (
+    "你是一个专业的、友好的地理空间分析AI助手。"
+    "你的任务是帮助用户分析地理数据。"
+    "当用户的指令不明确或缺少执行工具所需的必要参数时，你必须向用户提问以澄清问题。"
+    "在调用任何工具之前，请确保所有必需的参数都已从用户那里获得。"
+)
+SYSTEM_MESSAGE = {"role": "system", "content": SYSTEM_PROMPT}
+
+# 同一轮中并行执行工具调用的最大线程数
+TOOL_CALL_WORKERS = 4
+
 def run_agent_conversation(user_prompt: str, messages: list = None):
     """
     运行一个可能包含多轮对话的Agent流程。
@@ -667,37 +1335,38 @@ def run_agent_conversation(user_prompt: str, messages: list = None):
     """
     if messages is None:
         print("--- 开启新对话 ---")
-        # 为模型设置角色和行为准则
-        system_prompt = (
-            "你是一个专业的、友好的地理空间分析AI助手。"
-            "你的任务是帮助用户分析地理数据。"
-            "当用户的指令不明确或缺少执行工具所需的必要参数时，你必须向用户提问以澄清问题。"
-            "在调用任何工具之前，请确保所有必需的参数都已从用户那里获得。"
-        )
         messages = [
-            {"role": "system", "content": system_prompt},
+            SYSTEM_MESSAGE,
             {"role": "user", "content": user_prompt}
         ]
     else:
         print("--- 继续对话 ---")
+        # 无论历史从何而来，都以同一条系统提示词开头，保证请求前缀不变
+        if messages and messages[0].get("role") == "system":
+            messages[0] = SYSTEM_MESSAGE
+        else:
+            messages.insert(0, SYSTEM_MESSAGE)
         messages.append({"role": "user", "content": user_prompt})
 
     print(f"\n👤 用户: {user_prompt}\n")
     generated_files = []
 
     print("🤖 正在向 DeepSeek V2 发送请求...")
-    response = client.chat.completions.create(
-        model="deepseek-chat",
-        messages=messages,
-        tools=tools_description,
-        tool_choice="auto",
-    )
-    response_message = response.choices[0].message
-    tool_calls = response_message.tool_calls
-
     while True:
-        if not tool_calls:
-            final_answer = response_message.content
+        # 工具调用在流式接收过程中即被提交到线程池执行；各工具主要耗时在磁盘I/O与释放GIL的数值计算上，
+        # 同一轮中相互独立的多个调用可以并行，总耗时取决于最慢的一个而非全部之和
+        with ThreadPoolExecutor(max_workers=TOOL_CALL_WORKERS) as executor:
+            futures = []
+
+            def _dispatch(tool_call: dict):
+                futures.append(executor.submit(_execute_tool_call, tool_call, generated_files))
+
+            response_message = _request_model_response(messages, on_tool_call=_dispatch)
+            # 按调用顺序收集结果；每个调用各自处理错误，出错的调用向模型报告错误而不影响其他调用
+            tool_results = [future.result() for future in futures]
+
+        if not response_message.get("tool_calls"):
+            final_answer = response_message["content"] or ""
             # 检查这是否是一个问题
             is_question = "?" in final_answer or "？" in final_answer
             if is_question:
@@ -713,74 +1382,12 @@ def run_agent_conversation(user_prompt: str, messages: list = None):
                 "messages": messages
             }
 
-        print("✅ DeepSeek V2 决定调用一个或多个函数！")
-        # 将模型的工具调用决策添加到历史记录中
-        messages.append(response_message.model_dump())
-        
-        # 执行所有工具调用
-        for tool_call in tool_calls:
-            function_name = tool_call.function.name
-            try:
-                function_args = json.loads(tool_call.function.arguments)
-                print(f"   - 函数名: {function_name}")
-                print(f"   - 模型解析出的参数: {function_args}")
-
-                available_functions = {
-                    "preprocess_vehicle_data": preprocess_vehicle_data,
-                    "get_overall_bounds": get_overall_bounds,
-                    "kmeans_cluster": kmeans_cluster,
-                    "create_heatmap": create_heatmap,
-                    "create_gif_from_images": create_gif_from_images,
-                    "visualize_clusters": visualize_clusters,
-                }
-                function_to_call = available_functions.get(function_name)
-                
-                if function_to_call:
-                    function_response_str = function_to_call(**function_args)
-                    response_data = json.loads(function_response_str)
-
-                    # 收集所有输出的文件路径
-                    for key, value in response_data.items():
-                        if 'path' in key and isinstance(value, str):
-                            generated_files.append(value)
-                        elif key == 'generated_files' and isinstance(value, list):
-                            generated_files.extend(value)
-                    
-                    if response_data.get("status") == "error":
-                        print(f"❌ 函数执行失败: {response_data.get('message')}")
-                    
-                    # 将成功的工具执行结果添加到历史记录
-                    messages.append({
-                        "tool_call_id": tool_call.id,
-                        "role": "tool",
-                        "name": function_name,
-                        "content": function_response_str,
-                    })
-                else:
-                    raise ValueError(f"未知函数: {function_name}")
-
-            except (json.JSONDecodeError, TypeError, ValueError, KeyError) as e:
-                # 如果参数解析失败或函数执行出错，向模型报告错误
-                print(f"❌ 调用函数 '{function_name}' 时出错: {e}")
-                error_message = f"Error calling function {function_name}: {str(e)}. Please check your arguments."
-                messages.append({
-                    "tool_call_id": tool_call.id,
-                    "role": "tool",
-                    "name": function_name,
-                    "content": json.dumps({"status": "error", "message": error_message}),
-                })
-                # 跳过本次循环中剩余的工具调用，让模型根据错误报告决定下一步
-                break
-        
+        print("✅ DeepSeek V2 调用了一个或多个函数！")
+        # 将模型的工具调用决策及执行结果添加到历史记录中
+        messages.append(response_message)
+        messages.extend(tool_results)
+
         print("\n🔄 已执行本地函数，将结果返回给 DeepSeek V2 以决定下一步...")
-        response = client.chat.completions.create(
-            model="deepseek-chat",
-            messages=messages,
-            tools=tools_description,
-            tool_choice="auto",
-        )
-        response_message = response.choices[0].message
-        tool_calls = response_message.tool_calls
 
 if __name__ == '__main__':
     # --- 模拟一个多轮对话场景 ---
@@ -0,0 +1,27 @@
+import logging
+import queue
+from logging.handlers import QueueHandler, QueueListener
+
+# ==============================================================================
+# 日志
+# 调用方只把日志记录放入队列，由 QueueListener 的后台线程负责格式化和写出，避免同步I/O阻塞调用方
+# ==============================================================================
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+def create_queue_log_listener(logger: logging.Logger, level: int = logging.INFO) -> QueueListener:
+    """
+    为 logger 添加写入队列的 QueueHandler，并返回负责写出队列中日志的 QueueListener。
+    返回的 QueueListener 尚未启动，由调用方在合适的时机 start() / stop()。
+
+    :param logger: 要配置的日志记录器 (其日志不再向上级记录器传递)。
+    :param level: 日志级别。
+    :return: 未启动的 QueueListener。
+    """
+    log_queue = queue.SimpleQueue()
+    logger.setLevel(level)
+    logger.propagate = False
+    logger.addHandler(QueueHandler(log_queue))
+    handler = logging.StreamHandler()
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    return QueueListener(log_queue, handler)
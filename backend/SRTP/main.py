@@ -1,21 +1,54 @@
 import uvicorn
-import uuid
+import secrets
 import os
-import shutil
-from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request
+import hashlib
+import aiofiles
+from fastapi import FastAPI, HTTPException, UploadFile, File, Form, Request, Depends
 from fastapi.staticfiles import StaticFiles
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
 from typing import List, Optional, Dict
-import json
+import asyncio
+import functools
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
 
 # 从我们的代理脚本中导入核心功能
-from .deepseek_agent import run_agent_conversation
+from .deepseek_agent import run_agent_conversation, init_client, close_client, create_temp_file, OUTPUT_DIR
+from .conversation_store import create_conversation_store, trim_history
+from .logging_setup import create_queue_log_listener
+
+# --- 日志 ---
+# 请求处理中只把日志记录放入队列，由 QueueListener 的后台线程负责格式化和写出，避免同步I/O阻塞事件循环
+log = logging.getLogger("srtp")
+log_listener = create_queue_log_listener(log)
+
+# 同时执行的agent对话数上限
+AGENT_WORKERS = int(os.environ.get("SRTP_AGENT_WORKERS", str(min(32, (os.cpu_count() or 1) * 4))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # 所有客户端与连接池都在启动阶段 (每个 worker 进程 fork 之后) 创建，第一个请求到达前即已就绪
+    log_listener.start()
+    # --- 大模型客户端 ---
+    init_client()
+    # --- 会话存储 (设置 REDIS_URL 时使用Redis，多个worker进程共享会话) ---
+    app.state.conversations = create_conversation_store()
+    await app.state.conversations.open()
+    # 执行agent对话的有界线程池：并发对话数超过线程数时排队等待，而不是无限制地占用线程与内存
+    app.state.executor = ThreadPoolExecutor(max_workers=AGENT_WORKERS, thread_name_prefix="agent")
+    yield
+    app.state.executor.shutdown(wait=True)
+    await app.state.conversations.close()
+    close_client()
+    log_listener.stop()
 
 app = FastAPI(
     title="Conversational Geo-Analysis AI Agent API",
     description="一个能通过多轮对话与用户交互，进行地理空间数据分析的智能代理。",
     version="1.1.0",
+    lifespan=lifespan,
 )
 
 # 配置CORS中间件，允许跨域请求
@@ -27,14 +60,15 @@ app.add_middleware(
     allow_headers=["*"],  # 允许所有请求头
 )
 
-# --- 会话存储 (用于演示，生产环境应使用Redis, DB等) ---
-conversations: Dict[str, List[Dict]] = {}
-
 # 创建上传文件目录
 UPLOAD_DIR = "uploads"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
-#创建下载文件目录
-os.makedirs("outputs",exist_ok=True)
+# 上传文件的大小上限 (字节) 与分块写入的块大小
+MAX_UPLOAD_BYTES = int(os.environ.get("SRTP_MAX_UPLOAD_BYTES", str(100 * 1024 * 1024)))
+UPLOAD_CHUNK_SIZE = 1 << 20
+# 允许上传的文件扩展名 (与前端文件选择框的 accept 一致)
+ALLOWED_UPLOAD_EXTENSIONS = frozenset({".xlsx", ".xls", ".csv"})
+# 下载文件目录 (OUTPUT_DIR) 由 deepseek_agent 定义并创建，这里直接复用，保证两者始终一致
 
 # --- 请求和响应模型 ---
 
@@ -68,17 +102,55 @@ def format_response(result: dict, conversation_id: str):
         "generated_files": file_urls
     }
 
-async def _handle_file_upload(file: Optional[UploadFile], query: Optional[str], conversation_id: str) -> str:
+async def _save_upload(file: UploadFile) -> str:
+    """
+    将上传的文件分块异步写入磁盘，并以内容的 SHA-256 哈希命名 (uploads/<sha256><扩展名>)。
+    相同内容的文件只保存一份：哈希对应的文件已存在时直接复用，不再重复写入；
+    文件系统本身即是哈希索引，同一台机器上的所有 worker 进程都能共享。
+
+    :return: 保存后 (或已存在) 的文件路径。
+    """
+    # 保存的文件名只由内容哈希和规范化 (小写) 的扩展名组成，不使用用户提供的原始文件名
+    extension = os.path.splitext(file.filename or "")[1].lower()
+    if extension not in ALLOWED_UPLOAD_EXTENSIONS:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Unsupported file type '{extension}'. Allowed: {', '.join(sorted(ALLOWED_UPLOAD_EXTENSIONS))}"
+        )
+
+    # 先写入随机命名的临时文件，边写边计算哈希，写完后再原子地重命名，避免并发读取到写了一半的文件
+    fd, tmp_path = create_temp_file(".part", UPLOAD_DIR)
+    os.close(fd)
+    try:
+        # 分块异步写入磁盘，不阻塞事件循环，内存占用也只有一个块的大小
+        digest = hashlib.sha256()
+        written = 0
+        async with aiofiles.open(tmp_path, "wb") as buffer:
+            while chunk := await file.read(UPLOAD_CHUNK_SIZE):
+                written += len(chunk)
+                if written > MAX_UPLOAD_BYTES:
+                    # 超出大小上限时放弃写入，已写入的部分文件在 finally 中删除
+                    raise HTTPException(status_code=413, detail=f"Uploaded file exceeds the {MAX_UPLOAD_BYTES} byte limit")
+                digest.update(chunk)
+                await buffer.write(chunk)
+
+        file_path = os.path.join(UPLOAD_DIR, digest.hexdigest() + extension)
+        if os.path.exists(file_path):
+            log.info("上传文件 %s 与已有文件内容相同，复用 %s", file.filename, file_path)
+        else:
+            os.replace(tmp_path, file_path)
+            log.info("保存上传文件: %s -> %s", file.filename, file_path)
+        return file_path
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+async def _handle_file_upload(file: Optional[UploadFile], query: Optional[str]) -> str:
     """处理文件上传的辅助函数"""
     if file:
         # 保存上传的文件
-        file_path = os.path.join(UPLOAD_DIR, f"{conversation_id}_{file.filename}")
-        
-        print(f"保存上传文件: {file.filename} -> {file_path}")
-        
-        with open(file_path, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
-        
+        file_path = await _save_upload(file)
+
         # 将文件路径添加到查询中，让AI知道有文件需要处理
         if query and query.strip():
             user_prompt = f"{query}\n\n[上传的文件路径: {file_path}]"
@@ -89,93 +161,113 @@ async def _handle_file_upload(file: Optional[UploadFile], query: Optional[str],
     
     return user_prompt
 
+# --- 依赖项：在 lifespan 中创建的共享资源 ---
+
+def get_conversation_store(request: Request):
+    return request.app.state.conversations
+
+def get_executor(request: Request) -> ThreadPoolExecutor:
+    return request.app.state.executor
+
+async def _load_history(conversations, conversation_id: str) -> List[Dict]:
+    """读取已存在会话的历史消息 (裁剪并压缩较早的消息)，会话不存在时返回404。"""
+    messages = await conversations.get(conversation_id)
+    if messages is None:
+        raise HTTPException(status_code=404, detail="Conversation ID not found")
+    return trim_history(messages)
+
+async def _run_conversation(conversations, executor: ThreadPoolExecutor, conversation_id: str,
+                            user_prompt: str, messages: Optional[List[Dict]]):
+    """各对话端点共用的流程：调用agent、存储对话历史并格式化响应。"""
+    # agent 内部是同步的模型请求与工具调用，放到线程池中执行，避免阻塞事件循环上的其他请求
+    previous_count = len(messages) if messages else 0
+    loop = asyncio.get_running_loop()
+    result = await loop.run_in_executor(
+        executor,
+        functools.partial(run_agent_conversation, user_prompt=user_prompt, messages=messages),
+    )
+
+    # 只追加这一轮新产生的消息 (agent 在传入的历史之后追加消息)
+    await conversations.append(conversation_id, result.get("messages", [])[previous_count:])
+
+    return format_response(result, conversation_id)
+
 @app.post("/chat/start", response_model=ChatResponse, status_code=201)
 async def start_chat(
-    request: Request,
-    file: Optional[UploadFile] = File(None),
-    query: Optional[str] = Form(None)
+    chat_request: ChatRequest,
+    conversations=Depends(get_conversation_store),
+    executor: ThreadPoolExecutor = Depends(get_executor)
 ):
     """
-    开启一个新的对话会话。支持文件上传和纯文本请求。
+    开启一个新的对话会话 (纯文本请求)。
     """
-    conversation_id = str(uuid.uuid4())
-    print(f"--- 开启新会话: {conversation_id} ---")
-    
-    # 检查请求的Content-Type来判断请求格式
-    content_type = request.headers.get("content-type", "")
-    
-    if "multipart/form-data" in content_type:
-        # FormData请求（有文件上传）
-        print("处理FormData请求")
-        user_prompt = await _handle_file_upload(file, query, conversation_id)
-    elif "application/json" in content_type:
-        # JSON请求（纯文本）
-        print("处理JSON请求")
-        body = await request.body()
-        json_data = json.loads(body)
-        user_prompt = json_data.get("query", "")
-    else:
-        raise HTTPException(status_code=400, detail="Unsupported content type")
-    
+    conversation_id = secrets.token_hex(16)
+    log.info("开启新会话: %s", conversation_id)
+
     # 调用agent，不传递任何历史消息
-    result = run_agent_conversation(user_prompt=user_prompt, messages=None)
-    
-    # 存储这次对话的完整历史记录
-    conversations[conversation_id] = result.get("messages", [])
-    
-    return format_response(result, conversation_id)
+    return await _run_conversation(conversations, executor, conversation_id, chat_request.query, None)
+
+@app.post("/chat/start/upload", response_model=ChatResponse, status_code=201)
+async def start_chat_upload(
+    file: UploadFile = File(...),
+    query: Optional[str] = Form(None),
+    conversations=Depends(get_conversation_store),
+    executor: ThreadPoolExecutor = Depends(get_executor)
+):
+    """
+    开启一个新的对话会话，并同时上传一个文件 (multipart/form-data 请求)。
+    """
+    conversation_id = secrets.token_hex(16)
+    log.info("开启新会话: %s", conversation_id)
+
+    user_prompt = await _handle_file_upload(file, query)
+    return await _run_conversation(conversations, executor, conversation_id, user_prompt, None)
 
 @app.post("/chat/continue/{conversation_id}", response_model=ChatResponse)
 async def continue_chat(
     conversation_id: str,
-    request: Request,
-    file: Optional[UploadFile] = File(None),
-    query: Optional[str] = Form(None)
+    chat_request: ChatRequest,
+    conversations=Depends(get_conversation_store),
+    executor: ThreadPoolExecutor = Depends(get_executor)
 ):
     """
-    继续一个已存在的对话会话。支持文件上传和纯文本请求。
+    继续一个已存在的对话会话 (纯文本请求)。
     """
-    if conversation_id not in conversations:
-        raise HTTPException(status_code=404, detail="Conversation ID not found")
-    
-    print(f"--- 继续会话: {conversation_id} ---")
-
-    # 检查请求的Content-Type来判断请求格式
-    content_type = request.headers.get("content-type", "")
-    
-    if "multipart/form-data" in content_type:
-        # FormData请求（有文件上传）
-        print("处理FormData请求")
-        user_prompt = await _handle_file_upload(file, query, conversation_id)
-    elif "application/json" in content_type:
-        # JSON请求（纯文本）
-        print("处理JSON请求")
-        body = await request.body()
-        json_data = json.loads(body)
-        user_prompt = json_data.get("query", "")
-    else:
-        raise HTTPException(status_code=400, detail="Unsupported content type")
-
     # 获取之前的对话历史
-    messages = conversations[conversation_id]
-    
+    messages = await _load_history(conversations, conversation_id)
+    log.info("继续会话: %s", conversation_id)
+
     # 调用agent，并传入历史消息
-    result = run_agent_conversation(user_prompt=user_prompt, messages=messages)
-    
-    # 更新并存储对话历史
-    conversations[conversation_id] = result.get("messages", [])
-    
-    return format_response(result, conversation_id)
+    return await _run_conversation(conversations, executor, conversation_id, chat_request.query, messages)
+
+@app.post("/chat/continue/{conversation_id}/upload", response_model=ChatResponse)
+async def continue_chat_upload(
+    conversation_id: str,
+    file: UploadFile = File(...),
+    query: Optional[str] = Form(None),
+    conversations=Depends(get_conversation_store),
+    executor: ThreadPoolExecutor = Depends(get_executor)
+):
+    """
+    继续一个已存在的对话会话，并同时上传一个文件 (multipart/form-data 请求)。
+    """
+    # 先确认会话存在，再保存上传的文件
+    messages = await _load_history(conversations, conversation_id)
+    log.info("继续会话: %s", conversation_id)
+
+    user_prompt = await _handle_file_upload(file, query)
+    return await _run_conversation(conversations, executor, conversation_id, user_prompt, messages)
 
 # --- 静态文件服务 ---
-# 挂载静态文件目录，用于提供生成的图片、shp等文件
-app.mount("/outputs", StaticFiles(directory="./outputs"), name="outputs")
+# 挂载专用的输出目录 (而非整个工作目录)，用于提供生成的图片、shp等文件
+app.mount("/outputs", StaticFiles(directory=OUTPUT_DIR), name="outputs")
 # 挂载上传文件目录，用于提供上传的文件
 app.mount("/uploads", StaticFiles(directory=UPLOAD_DIR), name="uploads")
 
 if __name__ == "__main__":
-    # 使用 uvicorn 启动服务，监听在 8000 端口
-    # uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
-    # 注意：直接运行此文件将不再启动服务器，正确的启动方式是
-    # 在父目录运行: uvicorn SRTP.main:app --reload
-    print("要启动服务器, 请在项目根目录运行: uvicorn SRTP.main:app --reload")
\ No newline at end of file
+    # 注意：直接运行此文件不会启动服务器，正确的启动方式是在后端项目根目录运行
+    # 开发环境: uvicorn SRTP.main:app --reload
+    # 生产环境: gunicorn SRTP.main:app -c gunicorn.conf.py
+    print("要启动服务器, 请在后端项目根目录运行:")
+    print("  开发环境: uvicorn SRTP.main:app --reload")
+    print("  生产环境: gunicorn SRTP.main:app -c gunicorn.conf.py")
\ No newline at end of file
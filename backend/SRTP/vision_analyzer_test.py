@@ -1,12 +1,25 @@
 import os
-import base64
+import io
+import functools
 from openai import OpenAI
 import mimetypes
+import logging
+
+from .deepseek_agent import create_http_client
+from .logging_setup import create_queue_log_listener
+
+# pybase64 使用SIMD指令实现，编码数MB的文件时明显快于标准库；未安装时回退到标准库 base64
+try:
+    import pybase64 as base64
+except ImportError:
+    import base64
 
 # ==============================================================================
 # 1. 配置和客户端设置
 # ==============================================================================
 
+log = logging.getLogger("srtp.vision")
+
 # 从环境变量中获取API Key，并连接到OpenRouter API
 try:
     client = OpenAI(
@@ -16,9 +29,11 @@ try:
             "HTTP-Referer": "https://github.com/StartPoint-AI/GIS-Agent", # 推荐填写你的项目地址
             "X-Title": "GIS-Agent Vision Test", # 推荐填写你的项目名称
         },
+        # 与 DeepSeek 客户端使用相同配置的连接池：复用长连接，安装了 h2 时启用 HTTP/2
+        http_client=create_http_client(),
     )
 except Exception as e:
-    print("错误：请确保你已经设置了 OPENROUTER_API_KEY 环境变量。")
+    log.error("错误：请确保你已经设置了 OPENROUTER_API_KEY 环境变量。")
     exit()
 
 # 定义包含GIF文件的目录
@@ -28,6 +43,53 @@ OUTPUT_DIR = "outputs"
 # 2. 图像分析函数
 # ==============================================================================
 
+# 动图最多抽取的关键帧数、关键帧的最大边长 (像素)，以及关键帧的JPEG编码质量
+GIF_KEYFRAMES = 6
+KEYFRAME_MAX_SIZE = 1024
+KEYFRAME_JPEG_QUALITY = 85
+
+def _extract_keyframes(path: str, max_frames: int = GIF_KEYFRAMES):
+    """
+    从动图中按固定间隔抽取至多 max_frames 帧 (始终包含第一帧)，缩小到最大边长不超过 KEYFRAME_MAX_SIZE 后逐帧编码为JPEG字节串。
+    帧数不超过 max_frames 的动图 (包括单帧图片) 返回 None，直接发送原文件即可。
+    """
+    from PIL import Image, ImageSequence
+
+    with Image.open(path) as image:
+        n_frames = getattr(image, "n_frames", 1)
+        if n_frames <= max_frames:
+            return None
+        step = -(-n_frames // max_frames)  # 向上取整
+        keyframes = []
+        for index, frame in enumerate(ImageSequence.Iterator(image)):
+            if index % step == 0:
+                frame = frame.convert("RGB")
+                frame.thumbnail((KEYFRAME_MAX_SIZE, KEYFRAME_MAX_SIZE))
+                buffer = io.BytesIO()
+                frame.save(buffer, format="JPEG", quality=KEYFRAME_JPEG_QUALITY)
+                keyframes.append(buffer.getvalue())
+        return keyframes
+
+@functools.lru_cache(maxsize=64)
+def _encode_file(path: str, mtime_ns: int, size: int):
+    """
+    将图片文件编码为可直接发送给视觉模型的 data URL 元组。
+    帧数较多的动图拆分为若干缩小后的JPEG关键帧分别编码，请求体更小、模型推理也更快；
+    关键帧总大小不小于原文件时 (如帧数较少或色块平整的地图)，以及单帧图片，直接编码整个文件。
+    以 (路径, 修改时间, 文件大小) 为键缓存结果，重复分析或重试同一文件时无需再次读取和编码，文件变更后自动失效。
+    """
+    keyframes = _extract_keyframes(path)
+    if keyframes is not None and sum(len(frame) for frame in keyframes) < size:
+        return tuple(f"data:image/jpeg;base64,{base64.b64encode(frame).decode('utf-8')}" for frame in keyframes)
+
+    # 自动识别MIME类型
+    mime_type, _ = mimetypes.guess_type(path)
+    if mime_type is None:
+        mime_type = "image/gif" # 默认值
+
+    with open(path, "rb") as image_file:
+        return (f"data:{mime_type};base64,{base64.b64encode(image_file.read()).decode('utf-8')}",)
+
 def analyze_gif_with_vision(gif_path: str):
     """
     使用OpenRouter的Qwen视觉AI模型分析GIF动图。
@@ -35,67 +97,62 @@ def analyze_gif_with_vision(gif_path: str):
     :param gif_path: 要分析的GIF文件的路径。
     :return: 模型的文本分析结果。
     """
-    print(f"--- 正在分析GIF文件: {gif_path} ---")
+    log.info("--- 正在分析GIF文件: %s ---", gif_path)
 
     # 检查文件是否存在
     if not os.path.exists(gif_path):
         error_message = f"错误: 文件 '{gif_path}' 不存在。"
-        print(error_message)
+        log.error(error_message)
         return error_message
 
-    # 将GIF文件编码为Base64
+    # 将GIF文件 (或其关键帧) 编码为Base64
     try:
-        # 自动识别MIME类型
-        mime_type, _ = mimetypes.guess_type(gif_path)
-        if mime_type is None:
-            mime_type = "image/gif" # 默认值
+        stat = os.stat(gif_path)
+        image_urls = _encode_file(gif_path, stat.st_mtime_ns, stat.st_size)
 
-        with open(gif_path, "rb") as image_file:
-            base64_image = base64.b64encode(image_file.read()).decode('utf-8')
-        
-        print(f"   - 文件已成功编码为Base64字符串。")
-        print(f"   - MIME Type: {mime_type}")
+        log.info("   - 文件已成功编码为 %d 张图片的Base64字符串。", len(image_urls))
 
     except Exception as e:
         error_message = f"错误: 编码文件时出错: {e}"
-        print(error_message)
+        log.error(error_message)
         return error_message
 
     # 准备发送给模型的请求
+    if len(image_urls) > 1:
+        description = "以下是一个城市交通热力图随时间变化的GIF动图按时间顺序抽取的关键帧。"
+    else:
+        description = "这是一个城市交通热力图随时间变化的GIF。"
     messages = [
         {
             "role": "user",
             "content": [
                 {
                     "type": "text",
-                    "text": "这是一个城市交通热力图随时间变化的GIF。请你分析这个动图，并描述热力点的空间分布变化趋势。例如，热点区域是如何移动、扩大或缩小的？"
+                    "text": description + "请你分析这个动图，并描述热力点的空间分布变化趋势。例如，热点区域是如何移动、扩大或缩小的？"
                 },
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": f"data:{mime_type};base64,{base64_image}"
-                    }
-                }
+                *(
+                    {"type": "image_url", "image_url": {"url": image_url}}
+                    for image_url in image_urls
+                ),
             ]
         }
     ]
 
     # 发送请求到视觉模型
     try:
-        print("   - 正在向OpenRouter (Qwen)视觉模型发送请求...")
+        log.info("   - 正在向OpenRouter (Qwen)视觉模型发送请求...")
         response = client.chat.completions.create(
             model="Qwen/Qwen2.5-VL-32B-Instruct",  # 使用Qwen 2.5 视觉模型
             messages=messages,
             max_tokens=2048
         )
         analysis_result = response.choices[0].message.content
-        print("\n✅ AI分析结果:\n")
-        print(analysis_result)
+        log.info("\n✅ AI分析结果:\n\n%s", analysis_result)
         return analysis_result
 
     except Exception as e:
         error_message = f"错误: 调用API时出错: {e}"
-        print(error_message)
+        log.error(error_message)
         return error_message
 
 # ==============================================================================
@@ -103,13 +160,20 @@ def analyze_gif_with_vision(gif_path: str):
 # ==============================================================================
 
 if __name__ == '__main__':
+    # 日志记录先放入队列，由后台线程负责写出
+    log_listener = create_queue_log_listener(log)
+    log_listener.start()
+
     # 假设这是我们之前生成的GIF动画
-    # 注意：运行此脚本时，请确保工作目录是 srtp/backend/
+    # 注意：运行此脚本时，请确保工作目录是 srtp/backend/，并以 python -m SRTP.vision_analyzer_test 运行
     gif_to_test = os.path.join(OUTPUT_DIR, "start_points_heatmap_animation.gif")
     
-    # 检查文件是否存在于 `outputs` 目录中。
-    if not os.path.exists(gif_to_test):
-        print(f"测试失败：找不到用于测试的GIF文件 '{gif_to_test}'。")
-        print("请先运行主程序生成一个名为 'start_points_heatmap_animation.gif' 的文件并将其放在 'outputs' 文件夹中。")
-    else:
-        analyze_gif_with_vision(gif_to_test)
\ No newline at end of file
+    try:
+        # 检查文件是否存在于 `outputs` 目录中。
+        if not os.path.exists(gif_to_test):
+            log.error("测试失败：找不到用于测试的GIF文件 '%s'。", gif_to_test)
+            log.error("请先运行主程序生成一个名为 'start_points_heatmap_animation.gif' 的文件并将其放在 'outputs' 文件夹中。")
+        else:
+            analyze_gif_with_vision(gif_to_test)
+    finally:
+        log_listener.stop()
\ No newline at end of file
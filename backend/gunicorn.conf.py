@@ -0,0 +1,32 @@
+# ==============================================================================
+# Gunicorn 生产环境配置
+# 在后端项目根目录下运行: gunicorn SRTP.main:app -c gunicorn.conf.py
+# ==============================================================================
+import os
+import importlib.util
+import multiprocessing
+
+# 监听地址
+bind = os.environ.get("SRTP_BIND", "0.0.0.0:8000")
+
+# worker 进程数，默认 2 * CPU核数 + 1
+# 注意：多个 worker 之间不共享内存，需要设置 REDIS_URL 让所有 worker 共享会话
+workers = int(os.environ.get("WEB_CONCURRENCY", str(multiprocessing.cpu_count() * 2 + 1)))
+
+# 使用 Uvicorn 的 worker 运行 ASGI 应用 (安装了 uvicorn-worker 时优先使用，uvicorn.workers 已不再维护)
+worker_class = (
+    "uvicorn_worker.UvicornWorker"
+    if importlib.util.find_spec("uvicorn_worker") is not None
+    else "uvicorn.workers.UvicornWorker"
+)
+
+# HTTP 长连接的保持时间 (秒)
+keepalive = 5
+
+# agent 对话会调用大模型并执行分析工具，单个请求可能持续数分钟
+timeout = int(os.environ.get("SRTP_WORKER_TIMEOUT", "600"))
+graceful_timeout = 30
+
+# 在主进程中预先导入应用，worker 进程 fork 后共享已加载的模块，启动更快、内存占用更少。
+# 会话存储、线程池和日志线程都在每个 worker 的 lifespan 中创建，不会在进程之间共享。
+preload_app = True
@@ -69,8 +69,9 @@ function SimpleAIChat() {
         url = `http://localhost:8000/chat/continue/${conversationId}`;
       }
 
-      // 如果有文件，使用 FormData
+      // 如果有文件，使用 FormData 发送到对应的上传端点
       if (selectedFile) {
+        url = `${url}/upload`;
         const formData = new FormData();
         formData.append('file', selectedFile);
         formData.append('query', input.trim() || '请分析这个文件');